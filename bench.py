@@ -0,0 +1,304 @@
+#!/usr/bin/env python3.7
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+from time import monotonic
+
+MODULES = ('geometry', 'gui', 'htmlbuilder', 'mcollections', 'persist', 'psql', 'svg')
+ICON_SOURCE = (
+    '<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 512 512">'
+    '<path d="M 256.000 32.000 L 480.000 256.000 L 256.000 480.000 L 32.000 256.000 Z"/>'
+    '<path d="M 128.500,128.500 C 160.250,96.125 352.750,96.125 384.500,128.500 '
+    'S 416.000,352.000 384.500,384.500 Q 256.000,448.000 128.500,384.500 Z"/>'
+    '</svg>'
+)
+
+
+def rate(function, count):
+    """
+    Call function count times and return calls per second.
+    """
+    start = monotonic()
+    for _ in range(count):
+        function()
+    return count / (monotonic() - start)
+
+
+def bench_imports(options):
+    """
+    Cumulative import time of each module in microseconds, as reported
+    by python -X importtime in a fresh interpreter.
+    """
+    results = {}
+    for name in MODULES:
+        process = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import " + name],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.PIPE,
+            universal_newlines=True
+        )
+        for line in process.stderr.splitlines():
+            fields = line.split('|')
+            if len(fields) == 3 and fields[2].strip() == name:
+                results[name + '_us'] = int(fields[1])
+    return results
+
+
+def bench_htmlbuilder(options):
+    from htmlbuilder import Table, Tr, Th, Td, Html, Body
+
+    table = Table(
+        Tr([Th("column {}".format(i)) for i in range(5)]),
+        [Tr([Td(row * col, class_="cell") for col in range(5)]) for row in range(100)]
+    )
+    document = Html(Body(table))
+    return {'element_str_per_second': rate(lambda: str(document), options.repeat // 100)}
+
+
+def bench_geometry(options):
+    from geometry import Cone, Point
+
+    cone = Cone(90, 50, 45)
+    # Offset from the grid so no point lies on the cone's axis
+    points = [Point(x + 0.5, y) for x in range(-50, 51, 5) for y in range(-50, 51, 5)]
+
+    def contains():
+        for point in points:
+            point in cone
+
+    count = max(options.repeat // len(points), 1)
+    return {'cone_contains_per_second': rate(contains, count) * len(points)}
+
+
+def bench_mcollections(options):
+    from mcollections import LRU
+
+    lru = LRU(128)
+    keys = [i % 256 for i in range(options.repeat)]
+
+    def set_all():
+        for key in keys:
+            lru[key] = key
+
+    def get_all():
+        for key in keys:
+            try:
+                lru[key]
+            except KeyError:
+                pass
+
+    return {
+        'lru_set_per_second': rate(set_all, 1) * len(keys),
+        'lru_get_per_second': rate(get_all, 1) * len(keys),
+    }
+
+
+def bench_persist(options):
+    from persist import Persister
+
+    with tempfile.TemporaryDirectory() as directory:
+        persister = Persister(directory)
+        value = {'count': 0, 'items': list(range(100))}
+
+        def round_trip():
+            with persister as shelf:
+                shelf['value'] = value
+            with persister as shelf:
+                shelf['value']
+
+        return {'round_trips_per_second': rate(round_trip, max(options.repeat // 100, 1))}
+
+
+def bench_svg(options):
+    from svg import Icon, SVG, Gradient, CIRCLE, SQUARE, RADIAL
+
+    styles = [
+        {'bg_shape': shape, 'fg_fill': fill, 'shadow': shadow}
+        for shape in (None, CIRCLE, SQUARE)
+        for fill in ("#FFFFFF", Gradient("#FF0000", "#0000FF", RADIAL, "gradient-fg"))
+        for shadow in (False, True)
+    ]
+    count = max(options.repeat // 100, 1)
+    icon = Icon(ICON_SOURCE)
+    return {
+        'parse_render_per_second': rate(lambda: str(SVG(ICON_SOURCE)), count),
+        'variants_per_second': rate(lambda: icon.render(styles), count) * len(styles),
+    }
+
+
+def bench_gui(options):
+    import gui
+
+    results = {}
+    for name, result in gui.benchmark(frames=max(options.repeat // 50, 1)).items():
+        for key, value in result.items():
+            results["{}_{}".format(name, key)] = value
+    return results
+
+
+class StubCursor:
+    """
+    Cursor that accepts every statement and returns no rows.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def execute(self, query, vars=None):
+        self.connection.statements += 1
+
+    def mogrify(self, query, vars=None):
+        return query.encode() if isinstance(query, str) else query
+
+    def fetchall(self):
+        return []
+
+    def close(self):
+        pass
+
+
+class StubConnection:
+    """
+    Stand-in for a psycopg2 connection, so the PSQL write queue, group
+    commit and futures can be measured without a database.
+    """
+    def __init__(self, connection_string, cursor_factory=None):
+        self.closed = False
+        self.statements = 0
+        self.commits = 0
+
+    def cursor(self):
+        return StubCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        pass
+
+    def get_transaction_status(self):
+        return 0
+
+    def close(self):
+        self.closed = True
+
+
+PSQL_WRITE_MODES = {
+    'grouped': ('bench_writes',),
+    'ungrouped': ('bench_writes', 'bench_others'),
+}
+
+
+def psql_writes(db, count, modes=PSQL_WRITE_MODES):
+    """
+    Queue count inserts, as one repeated statement that group commit
+    merges into execute_batch calls (grouped) and alternating between
+    two statements so each is executed on its own (ungrouped), and
+    return writes per second for each mode.
+    """
+    results = {}
+    for name in modes:
+        tables = PSQL_WRITE_MODES[name]
+        start = monotonic()
+        for i in range(count):
+            db.execute("INSERT INTO {} VALUES (%s, %s)".format(tables[i % len(tables)]), (i, str(i)))
+        db.flush()
+        results[name + '_writes_per_second'] = count / (monotonic() - start)
+    results['mean_batch_size'] = db.write_stats.mean_batch_size
+    return results
+
+
+def bench_psql(options):
+    """
+    PSQL write throughput on stub connections, which only measures the
+    write queue, batching and futures. With --dsn, also write and COPY
+    throughput into temporary tables and read throughput with and
+    without the pool against that database.
+    """
+    import psql
+
+    results = {}
+    try:
+        # Grouped writes need the driver's execute_batch, without it they
+        # would silently fall back to write_isolated
+        try:
+            psql.psycopg2.extras
+            modes = PSQL_WRITE_MODES
+        except ImportError:
+            modes = ('ungrouped',)
+        db = psql.PSQL("stub", connect=StubConnection)
+        try:
+            results['stub'] = psql_writes(db, options.repeat, modes)
+        finally:
+            db.close()
+    except Exception as e:
+        results['stub'] = {'skipped': "{}: {}".format(type(e).__name__, e)}
+
+    if options.dsn is None:
+        results['database'] = {'skipped': "no --dsn given"}
+        return results
+    try:
+        db = psql.PSQL(options.dsn)
+        try:
+            db.execute("CREATE TEMP TABLE bench_writes (id integer, value text)").result()
+            db.execute("CREATE TEMP TABLE bench_others (id integer, value text)").result()
+            results['database'] = psql_writes(db, options.repeat)
+            copied = db.copy('bench_writes', ((i, str(i)) for i in range(options.repeat)), ('id', 'value'))
+            results['database']['copy_rows_per_second'] = copied.rows_per_second
+        finally:
+            db.close()
+        for name, reads in psql.benchmark(options.dsn, 4, options.repeat // 10, "SELECT 1").items():
+            results['database'][name + '_reads_per_second'] = reads
+    except Exception as e:
+        results['database'] = {'skipped': "{}: {}".format(type(e).__name__, e)}
+    return results
+
+
+BENCHMARKS = {
+    'imports': bench_imports,
+    'htmlbuilder': bench_htmlbuilder,
+    'geometry': bench_geometry,
+    'mcollections': bench_mcollections,
+    'persist': bench_persist,
+    'svg': bench_svg,
+    'gui': bench_gui,
+    'psql': bench_psql,
+}
+
+
+def run(options, names=None):
+    """
+    Run the named benchmarks, all by default, and return a record of
+    their results that can be serialized as JSON.
+    """
+    return {
+        'time': datetime.now().isoformat(timespec='seconds'),
+        'python': sys.version.split()[0],
+        'repeat': options.repeat,
+        'results': {name: BENCHMARKS[name](options) for name in names or BENCHMARKS},
+    }
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("benchmarks", nargs="*", help=", ".join(BENCHMARKS))
+    parser.add_argument("--repeat", type=int, default=10000)
+    parser.add_argument("--dsn", default=os.environ.get("BENCH_DSN"))
+    parser.add_argument("--output", help="append the results as a line of JSON to this file")
+    args = parser.parse_args()
+
+    record = run(args, args.benchmarks)
+    if args.output:
+        with open(args.output, "a") as results:
+            results.write(json.dumps(record) + "\n")
+    print(json.dumps(record, indent=4))
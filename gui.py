@@ -1,12 +1,21 @@
 #!/usr/bin/env python3
-import curses
+import os
+import sys
+from collections import deque, namedtuple
 from datetime import datetime
-from time import sleep
-from threading import Thread, Lock
+from time import sleep, monotonic
+from threading import Thread, Lock, Event
 from pathlib import Path
 
 # Configuration
-SLEEP_TIME = 0.01
+FRAME_RATE = 30
+ON_DEMAND_TIMEOUT = 0.1
+FRAME_HISTORY = 120
+LOG_PATH = Path.home() / ".gui_log"
+LOG_FLUSH_INTERVAL = 0.5
+LOG_QUEUE_SIZE = 10000
+INPUT_TIMEOUT = 50
+INPUT_INTERVAL = 0.01
 
 # Directions
 LEFT        = 0
@@ -29,21 +38,38 @@ BOTTOM_LEFT     = 14
 BOTTOM_CENTER   = 15
 BOTTOM_RIGHT    = 16
 
+# Attributes, same value as curses.A_NORMAL without importing curses
+A_NORMAL = 0
+
 # Singletons
-BLANK_PIXEL = (' ', curses.A_NORMAL)
+BLANK_PIXEL = (' ', A_NORMAL)
 
 
 class GUI:
-    def __init__(self):
+    def __init__(self, *, fps=FRAME_RATE, on_demand=False, backend=None):
         """
-        GUI constructor. Does not take any parameters.
+        GUI constructor. fps is the target frame rate. With on_demand,
+        frames are only rendered after a keypress, a resize or a call
+        to GUI.invalidate(). backend is the screen context manager to run
+        in, a curses Screen by default or a HeadlessScreen.
         """
         self.running = True
+        self.backend = backend
         self.input_thread = Thread(target=input_thread, args=(self,))
         self.render_thread = Thread(target=render_thread, args=(self,))
         self.lock = Lock()
         self.screen = None
-        self.pixels = {}
+        self.framebuffer = Framebuffer()
+        self.fps = fps
+        self.on_demand = on_demand
+        self.invalidated = Event()
+        self.frame_stats = FrameStats()
+        self.events = []
+        self.loop = None
+        self.async_invalidated = None
+        self.logger = Logger(LOG_PATH)
+        self.cells_written = 0
+        self.runs_written = 0
 
     def __bool__(self):
         """
@@ -65,8 +91,8 @@ class GUI:
         """
         Abstract method.
 
-        This method is called on each frame (30 times per second) before
-        the render and post_render methods.
+        This method is called on each frame (fps times per second, or
+        on demand) before the render and post_render methods.
         """
         pass
 
@@ -74,8 +100,8 @@ class GUI:
         """
         Abstract method.
 
-        This method is called on each frame (30 times per second) after
-        pre_render and before post_render.
+        This method is called on each frame (fps times per second, or
+        on demand) after pre_render and before post_render.
         """
         pass
 
@@ -83,8 +109,8 @@ class GUI:
         """
         Abstract method.
 
-        This method is called on each frame (30 times per second) after
-        pre_render and render.
+        This method is called on each frame (fps times per second, or
+        on demand) after pre_render and render.
         """
         pass
 
@@ -96,23 +122,32 @@ class GUI:
         """
         pass
 
+    def keypresses(self, events):
+        """
+        This method is called on the render thread at the start of each
+        frame with the KeyEvents received since the last frame, repeats
+        of a key coalesced into one event with a count. By default it
+        calls keypress once per key press.
+        """
+        for key, count in events:
+            for _ in range(count):
+                self.keypress(key)
+
     # Public Methods
     def log(self, *args, sep=' ', end='\n'):
-        timestamp = str(datetime.now())
-        with open(Path.home() / ".gui_log", "a") as log_file:
-            log_file.write(timestamp)
-            log_file.write(" ")
-            log_file.write(sep.join(args))
-            log_file.write(end)
+        """
+        Queues a timestamped line for the log file without blocking.
+        """
+        self.logger.log(str(datetime.now()) + " " + sep.join(args) + end)
 
     def start(self):
         """
         Start the gui's main loops.
         GUI.start should only be called once.
         """
-        open(Path.home() / '.gui_log', 'w').close()
+        self.logger.start()
         self.log("GUI start")
-        with Screen() as screen:
+        with (self.backend or Screen()) as screen:
             self.screen = screen
             self.setup()
             self.input_thread.start()
@@ -126,15 +161,55 @@ class GUI:
                     self.stop()
                     self.log("GUI ended by keyboard interrupt")
         self.log("GUI end")
+        self.logger.close()
+
+    async def run(self):
+        """
+        Run the gui's main loops as tasks on the running event loop
+        instead of the input and render threads. Alternative to
+        GUI.start, which returns when the gui stops.
+        """
+        self.logger.start()
+        self.log("GUI start")
+        import asyncio
+        backend = self.backend or Screen()
+        with backend as screen:
+            self.screen = screen
+            self.screen.timeout(0)
+            self.loop = asyncio.get_running_loop()
+            self.async_invalidated = asyncio.Event()
+            self.setup()
+            tasks = [
+                asyncio.ensure_future(input_task(self, getattr(backend, 'fileno', None))),
+                asyncio.ensure_future(render_task(self))
+            ]
+            try:
+                await asyncio.gather(*tasks)
+            finally:
+                for task in tasks:
+                    task.cancel()
+                self.loop = None
+        self.log("GUI end")
+        self.logger.close()
 
     def stop(self):
         """
         Tell the threads to end and the start method to return.
         """
         self.running = False
+        self.invalidate()
+
+    def invalidate(self):
+        """
+        Request a new frame. Only needed in on demand mode.
+        """
+        self.invalidated.set()
+        loop = self.loop
+        if loop is not None:
+            loop.call_soon_threadsafe(self.async_invalidated.set)
 
     def draw_string(self, coord, string, *,
-            attr=curses.A_NORMAL,
+            attr=A_NORMAL,
             direction=RIGHT,
             origin=BOTTOM_LEFT):
         """
@@ -143,18 +218,28 @@ class GUI:
         """
         x, y = coord
         origin_x, origin_y = self.get_origin_reference(origin)
+        x += origin_x
+        y += origin_y
+        curses_y = self.screen_height - (y + 1)
+        # Horizontal strings are a single slice write
+        if direction == RIGHT:
+            self.framebuffer.write(curses_y, x, string, attr)
+            return
+        elif direction == LEFT:
+            self.framebuffer.write(curses_y, x - len(string) + 1, string[::-1], attr)
+            return
         directional_x, directional_y = self.get_directional_reference(direction)
         for i, character in enumerate(string):
             self.draw(
                 (
-                    origin_x + (x + directional_x * i),
-                    origin_y + (y + directional_y * i)
+                    x + directional_x * i,
+                    y + directional_y * i
                 ),
                 character,
                 attr=attr
             )
 
-    def draw(self, coord, character, *, attr=curses.A_NORMAL):
+    def draw(self, coord, character, *, attr=A_NORMAL):
         """
         Updates a single pixel, translating from regular
         x and y coord pair to upside down y, x pair for curses
@@ -163,8 +248,61 @@ class GUI:
         x, y = coord
         if 0 <= x < self.screen_width and 0 <= y < self.screen_height:
             curses_y = self.screen_height - (y + 1)
-            curses_coord = (curses_y, x)
-            self.pixels[curses_coord] = (character, attr)
+            self.framebuffer.characters[curses_y][x] = character
+            self.framebuffer.attrs[curses_y][x] = attr
+
+    def fill_rect(self, coord, size, character=' ', *,
+            attr=A_NORMAL,
+            origin=BOTTOM_LEFT):
+        """
+        Fills a width by height rectangle whose bottom left corner is
+        at coord, ignoring pixels out of the bounds of the screen.
+        """
+        x, y = coord
+        width, height = size
+        origin_x, origin_y = self.get_origin_reference(origin)
+        x += origin_x
+        y += origin_y
+        self.framebuffer.fill(
+            self.screen_height - (y + height),
+            x,
+            height,
+            width,
+            character,
+            attr
+        )
+
+    def hline(self, coord, length, character='-', *,
+            attr=A_NORMAL,
+            origin=BOTTOM_LEFT):
+        """
+        Draws a horizontal line rightwards from coord.
+        """
+        self.fill_rect(coord, (length, 1), character, attr=attr, origin=origin)
+
+    def vline(self, coord, length, character='|', *,
+            attr=A_NORMAL,
+            origin=BOTTOM_LEFT):
+        """
+        Draws a vertical line upwards from coord.
+        """
+        self.fill_rect(coord, (1, length), character, attr=attr, origin=origin)
+
+    def blit(self, coord, sprite, *, origin=BOTTOM_LEFT):
+        """
+        Copies a Sprite onto the screen with its top left corner at coord.
+        """
+        x, y = coord
+        origin_x, origin_y = self.get_origin_reference(origin)
+        x += origin_x
+        y += origin_y
+        self.framebuffer.blit(self.screen_height - (y + 1), x, sprite)
+
+    def clear(self):
+        """
+        Blanks every pixel of the current frame.
+        """
+        self.framebuffer.clear()
 
     def get_directional_reference(self, direction):
         if direction == LEFT:
@@ -209,17 +347,53 @@ class GUI:
             raise ValueError("Unknown origin '{}'".format(origin))
 
 
+KeyEventFields = ('key', 'count')
+class KeyEvent(namedtuple("KeyEvent", KeyEventFields)):
+    pass
+
+
+def read_keys(gui, key=-1):
+    """
+    Read every key available without waiting, starting with key if one
+    was already read, and queue them for the next frame.
+    """
+    events = []
+    while True:
+        if key == -1:
+            key = gui.screen.getch()
+            if key == -1:
+                break
+        if events and events[-1].key == key:
+            events[-1] = KeyEvent(key, events[-1].count + 1)
+        else:
+            events.append(KeyEvent(key, 1))
+        key = -1
+    if events:
+        with gui.lock:
+            if gui.events and gui.events[-1].key == events[0].key:
+                events[0] = KeyEvent(events[0].key, gui.events.pop().count + events[0].count)
+            gui.events.extend(events)
+        gui.invalidate()
+
+
 def input_thread(gui):
     """
-    This thread runs the gui.io function in a loop to
-    get input from the user.
+    This thread waits for input from the user and queues
+    everything available at once for the render thread.
     """
+    # Curses windows can't report their timeout, headless ones can
+    delay = getattr(gui.screen, 'delay', None)
+    timeout = INPUT_TIMEOUT if delay is None else round(delay * 1000)
     while gui:
         try:
             key = gui.screen.getch()
             if key == -1:
                 continue
-            gui.keypress(key)
+            gui.screen.timeout(0)
+            try:
+                read_keys(gui, key)
+            finally:
+                gui.screen.timeout(timeout)
         except (KeyboardInterrupt, EOFError):
             gui.stop()
             gui.log("Input thread received Keyboard Interrupt / EOF")
@@ -230,41 +404,440 @@ def input_thread(gui):
 
 def render_thread(gui):
     """
-    This thread runs the gui.render function thirty times per
-    second and stops the gui if any errors occur.
+    This thread renders a frame fps times per second, or only when
+    invalidated in on demand mode, and stops the gui if any errors occur.
     """
+    previous = Framebuffer()
+    deadline = monotonic()
     while gui:
-        sleep(SLEEP_TIME)
         try:
-            # Update the window size
-            gui.screen_size = gui.screen.getmaxyx()
-            gui.screen_height = gui.screen_size[0]
-            gui.screen_width = gui.screen_size[1]
-
-            # Run the render functions to populate pixels
-            gui.pre_render()
-            gui.render()
-            gui.post_render()
-
-            # Output the pixels to the screen.
-            for y in range(gui.screen_height):
-                for x in range(gui.screen_width):
-                    pixel = gui.pixels.get((y, x), BLANK_PIXEL)
-                    try:
-                        gui.screen.addstr(y, x, *pixel)
-                    except Exception as e:
-                        pass
-
-            # Zero the pixels
-            gui.pixels = {}
+            if gui.on_demand:
+                if not gui.invalidated.wait(ON_DEMAND_TIMEOUT):
+                    if gui.screen.getmaxyx() == (previous.height, previous.width):
+                        continue
+                elif not gui:
+                    break
+                # Invalidations are coalesced into at most fps frames per
+                # second, those arriving while waiting join the next frame
+                now = monotonic()
+                if deadline > now:
+                    sleep(deadline - now)
+                    now = monotonic()
+                gui.invalidated.clear()
+                render_frame(gui, previous)
+                deadline = now + 1 / gui.fps
+                continue
+
+            # Sleep until this frame's deadline, not a fixed time after
+            # the last frame finished
+            now = monotonic()
+            if deadline > now:
+                sleep(deadline - now)
+            gui.invalidated.clear()
+            render_frame(gui, previous)
+            deadline = next_deadline(gui, deadline)
 
         except BaseException as e:
             gui.stop()
             gui.log("Render thread exception, {}: {}".format(type(e), e))
 
 
+def next_deadline(gui, deadline):
+    period = 1 / gui.fps
+    deadline += period
+    now = monotonic()
+    if now > deadline:
+        gui.frame_stats.dropped += int((now - deadline) / period) + 1
+        deadline = now
+    return deadline
+
+
+async def input_task(gui, fileno=None):
+    """
+    Async counterpart of input_thread. Waits for the backend's file
+    descriptor to become readable if it has one, otherwise polls.
+    """
+    import asyncio
+    loop = asyncio.get_running_loop()
+    fd = fileno() if fileno else None
+    while gui:
+        try:
+            read_keys(gui)
+            if fd is None:
+                await asyncio.sleep(INPUT_INTERVAL)
+                continue
+            readable = loop.create_future()
+            loop.add_reader(fd, lambda: readable.done() or readable.set_result(None))
+            try:
+                await asyncio.wait_for(readable, INPUT_TIMEOUT / 1000)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                loop.remove_reader(fd)
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            gui.stop()
+            gui.log("Input task exception, {}: {}".format(type(e), e))
+
+
+async def render_task(gui):
+    """
+    Async counterpart of render_thread.
+    """
+    import asyncio
+    previous = Framebuffer()
+    deadline = monotonic()
+    while gui:
+        try:
+            if gui.on_demand:
+                try:
+                    await asyncio.wait_for(gui.async_invalidated.wait(), ON_DEMAND_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if gui.screen.getmaxyx() == (previous.height, previous.width):
+                        continue
+                if not gui:
+                    break
+                now = monotonic()
+                if deadline > now:
+                    await asyncio.sleep(deadline - now)
+                    now = monotonic()
+                gui.async_invalidated.clear()
+                gui.invalidated.clear()
+                render_frame(gui, previous)
+                deadline = now + 1 / gui.fps
+                continue
+
+            await asyncio.sleep(max(0, deadline - monotonic()))
+            gui.invalidated.clear()
+            render_frame(gui, previous)
+            deadline = next_deadline(gui, deadline)
+
+        except asyncio.CancelledError:
+            raise
+        except BaseException as e:
+            gui.stop()
+            gui.log("Render task exception, {}: {}".format(type(e), e))
+
+
+def render_frame(gui, previous):
+    start = monotonic()
+
+    # Update the window size
+    gui.screen_size = gui.screen.getmaxyx()
+    gui.screen_height = gui.screen_size[0]
+    gui.screen_width = gui.screen_size[1]
+    resized = gui.screen_size != (previous.height, previous.width)
+    if resized:
+        gui.framebuffer.resize(gui.screen_height, gui.screen_width)
+        previous.resize(gui.screen_height, gui.screen_width)
+
+    # Deliver the input received since the last frame
+    if gui.events:
+        with gui.lock:
+            events, gui.events = gui.events, []
+        gui.keypresses(events)
+
+    # Run the render functions to populate pixels
+    gui.pre_render()
+    pre_rendered = monotonic()
+    gui.render()
+    rendered = monotonic()
+    gui.post_render()
+    post_rendered = monotonic()
+
+    # Output only the pixels that changed since the last frame,
+    # or every pixel after the screen was resized
+    runs = gui.framebuffer.runs(None if resized else previous)
+    for y, x, string, attr in runs:
+        try:
+            gui.screen.addstr(y, x, string, attr)
+        except Exception as e:
+            pass
+    # Present the frame now rather than on the input thread's next getch
+    gui.screen.refresh()
+    flushed = monotonic()
+    gui.cells_written = sum(len(run[2]) for run in runs)
+    gui.runs_written = len(runs)
+
+    # Keep this frame to diff against and zero the pixels
+    previous.copy_from(gui.framebuffer)
+    gui.framebuffer.clear()
+
+    gui.frame_stats.record(FrameTiming(
+        start,
+        pre_rendered - start,
+        rendered - pre_rendered,
+        post_rendered - rendered,
+        flushed - post_rendered,
+        gui.cells_written,
+        gui.runs_written
+    ))
+
+
+FrameTimingFields = ('start', 'pre_render', 'render', 'post_render', 'flush', 'cells', 'runs')
+class FrameTiming(namedtuple("FrameTiming", FrameTimingFields)):
+    @property
+    def total(self):
+        return self.pre_render + self.render + self.post_render + self.flush
+
+
+class FrameStats:
+    """
+    Timings of the most recent frames and a count of frames rendered
+    after their deadline had already passed.
+    """
+    def __init__(self, history=FRAME_HISTORY):
+        self.frames = 0
+        self.dropped = 0
+        self.history = deque(maxlen=history)
+
+    def __repr__(self):
+        return "{}(frames={}, dropped={}, fps={:.1f})".format(
+            type(self).__name__,
+            self.frames,
+            self.dropped,
+            self.fps
+        )
+
+    def record(self, timing):
+        self.frames += 1
+        self.history.append(timing)
+
+    @property
+    def last(self):
+        return self.history[-1] if self.history else None
+
+    @property
+    def fps(self):
+        if len(self.history) < 2:
+            return 0.0
+        elapsed = self.history[-1].start - self.history[0].start
+        return (len(self.history) - 1) / elapsed if elapsed else 0.0
+
+    def mean(self):
+        """
+        Mean FrameTiming over the recorded history, with start set to 0.
+        """
+        if not self.history:
+            return None
+        count = len(self.history)
+        return FrameTiming(0, *(
+            sum(values) / count for values in list(zip(*self.history))[1:]
+        ))
+
+
+class Logger:
+    """
+    Log file writer that keeps the file open and writes queued records
+    from a background thread in batches every flush_interval seconds.
+    Records beyond max_queue are dropped and counted rather than making
+    the caller wait, and the file is rotated once it grows past
+    max_bytes, keeping backups old copies.
+    """
+    def __init__(self, path, *,
+            flush_interval=LOG_FLUSH_INTERVAL,
+            max_queue=LOG_QUEUE_SIZE,
+            max_bytes=None,
+            backups=1):
+        self.path = Path(path)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.records = deque()
+        self.dropped = 0
+        self.running = False
+        self.closed = False
+        self.wake = Event()
+        self.thread = None
+        self.file = None
+
+    def log(self, record):
+        # Nothing will drain the queue once closed, write directly
+        if self.closed:
+            with open(self.path, "a") as log_file:
+                log_file.write(record)
+            return
+        if len(self.records) >= self.max_queue:
+            self.dropped += 1
+            return
+        self.records.append(record)
+
+    def start(self, truncate=True):
+        self.file = open(self.path, "w" if truncate else "a")
+        self.running = True
+        self.thread = Thread(target=log_thread, args=(self,), daemon=True)
+        self.thread.start()
+
+    def close(self):
+        """
+        Stop the writer thread, writing out any queued records.
+        """
+        self.running = False
+        self.closed = True
+        self.wake.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+        if self.file is not None:
+            self.write()
+            self.file.close()
+            self.file = None
+
+    def write(self):
+        records = []
+        try:
+            while True:
+                records.append(self.records.popleft())
+        except IndexError:
+            pass
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            records.append("{} {} log records dropped\n".format(datetime.now(), dropped))
+        if not records:
+            return
+        self.file.write("".join(records))
+        self.file.flush()
+        if self.max_bytes is not None and self.file.tell() >= self.max_bytes:
+            self.rotate()
+
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            backup = self.path.with_name("{}.{}".format(self.path.name, i))
+            if backup.exists():
+                os.replace(backup, self.path.with_name("{}.{}".format(self.path.name, i + 1)))
+        if self.backups:
+            os.replace(self.path, self.path.with_name(self.path.name + ".1"))
+        self.file = open(self.path, "w")
+
+
+def log_thread(logger):
+    """
+    This thread writes out the logger's queued records every
+    flush_interval seconds until the logger is closed.
+    """
+    while logger.running:
+        logger.wake.wait(logger.flush_interval)
+        logger.write()
+
+
+class Framebuffer:
+    """
+    Preallocated rows of characters and attributes in curses (y, x)
+    order. Drawing writes slices of rows in place.
+    """
+    def __init__(self, height=0, width=0):
+        self.resize(height, width)
+
+    def resize(self, height, width):
+        self.height = height
+        self.width = width
+        self.blank_characters = [' '] * width
+        self.blank_attrs = [A_NORMAL] * width
+        self.characters = [list(self.blank_characters) for _ in range(height)]
+        self.attrs = [list(self.blank_attrs) for _ in range(height)]
+
+    def clear(self):
+        for row in self.characters:
+            row[:] = self.blank_characters
+        for row in self.attrs:
+            row[:] = self.blank_attrs
+
+    def copy_from(self, other):
+        for row, other_row in zip(self.characters, other.characters):
+            row[:] = other_row
+        for row, other_row in zip(self.attrs, other.attrs):
+            row[:] = other_row
+
+    def write(self, y, x, string, attr=A_NORMAL):
+        if not 0 <= y < self.height:
+            return
+        start = max(x, 0)
+        end = min(x + len(string), self.width)
+        if start < end:
+            self.characters[y][start:end] = string[start - x:end - x]
+            self.attrs[y][start:end] = [attr] * (end - start)
+
+    def fill(self, y, x, height, width, character=' ', attr=A_NORMAL):
+        start = max(x, 0)
+        end = min(x + width, self.width)
+        if start >= end:
+            return
+        characters = [character] * (end - start)
+        attrs = [attr] * (end - start)
+        for row in range(max(y, 0), min(y + height, self.height)):
+            self.characters[row][start:end] = characters
+            self.attrs[row][start:end] = attrs
+
+    def blit(self, y, x, sprite):
+        start = max(x, 0)
+        end = min(x + sprite.width, self.width)
+        if start >= end:
+            return
+        for i in range(max(0, -y), min(sprite.height, self.height - y)):
+            self.characters[y + i][start:end] = sprite.characters[i][start - x:end - x]
+            self.attrs[y + i][start:end] = sprite.attrs[i][start - x:end - x]
+
+    def runs(self, previous=None):
+        """
+        Return (y, x, string, attr) runs of horizontally adjacent cells
+        that share an attribute and differ from previous, or of every cell
+        if previous is None.
+        """
+        runs = []
+        for y in range(self.height):
+            characters = self.characters[y]
+            attrs = self.attrs[y]
+            if previous is not None:
+                old_characters = previous.characters[y]
+                old_attrs = previous.attrs[y]
+                if characters == old_characters and attrs == old_attrs:
+                    continue
+            run_x = None
+            run_attr = None
+            for x in range(self.width):
+                attr = attrs[x]
+                if previous is not None and characters[x] == old_characters[x] and attr == old_attrs[x]:
+                    if run_x is not None:
+                        runs.append((y, run_x, ''.join(characters[run_x:x]), run_attr))
+                        run_x = None
+                    continue
+                if run_x is not None and attr != run_attr:
+                    runs.append((y, run_x, ''.join(characters[run_x:x]), run_attr))
+                    run_x = None
+                if run_x is None:
+                    run_x = x
+                    run_attr = attr
+            if run_x is not None:
+                runs.append((y, run_x, ''.join(characters[run_x:]), run_attr))
+        return runs
+
+
+class Sprite:
+    """
+    Prebuilt block of pixels for GUI.blit, given as a list of strings
+    for the rows from top to bottom and an attribute, or a matching list
+    of per-pixel attribute lists.
+    """
+    def __init__(self, lines, attr=A_NORMAL, attrs=None):
+        self.height = len(lines)
+        self.width = max((len(line) for line in lines), default=0)
+        self.characters = [list(line.ljust(self.width)) for line in lines]
+        if attrs is None:
+            self.attrs = [[attr] * self.width for _ in lines]
+        else:
+            self.attrs = [
+                list(row) + [attr] * (self.width - len(row))
+                for row in attrs
+            ]
+
+
 class Screen:
     def __enter__(self):
+        import curses
+
         # Initialize screen
         self.screen = curses.initscr()
         curses.noecho()
@@ -279,15 +852,161 @@ class Screen:
 
         # Set cursor invisible and timeout on read
         curses.curs_set(0)
-        self.screen.timeout(50)
+        self.screen.timeout(INPUT_TIMEOUT)
 
         # Return the curses screen
         return self.screen
 
+    def fileno(self):
+        return sys.stdin.fileno()
+
     def __exit__(self, *args, **kwargs):
+        import curses
+
         # Return terminal to normal
         curses.curs_set(1)
         self.screen.keypad(0)
         curses.echo()
         curses.nocbreak()
         curses.endwin()
+
+
+class HeadlessScreen:
+    """
+    In-memory screen backend with the same context manager interface as
+    Screen. The window it returns implements the curses calls the GUI
+    makes, reads keys from a script and can capture each frame.
+    """
+    def __init__(self, height=24, width=80, keys=(), *, timeout=0.05, capture=False):
+        self.window = HeadlessWindow(height, width, keys, timeout=timeout, capture=capture)
+
+    def __enter__(self):
+        return self.window
+
+    def __exit__(self, *args, **kwargs):
+        pass
+
+
+class HeadlessWindow:
+    def __init__(self, height=24, width=80, keys=(), *, timeout=0.05, capture=False):
+        self.delay = timeout
+        self.capture = capture
+        self.keys = deque(ord(key) if isinstance(key, str) else key for key in keys)
+        self.frames = []
+        self.addstr_calls = 0
+        self.resize(height, width)
+
+    def resize(self, height, width):
+        self.height = height
+        self.width = width
+        self.rows = [[' '] * width for _ in range(height)]
+
+    def press(self, *keys):
+        self.keys.extend(ord(key) if isinstance(key, str) else key for key in keys)
+
+    def getmaxyx(self):
+        return (self.height, self.width)
+
+    def getch(self):
+        try:
+            return self.keys.popleft()
+        except IndexError:
+            if self.delay:
+                sleep(self.delay)
+            return -1
+
+    def timeout(self, delay):
+        self.delay = max(delay, 0) / 1000
+
+    def addstr(self, y, x, string, attr=A_NORMAL):
+        self.addstr_calls += 1
+        if not 0 <= y < self.height or not 0 <= x < self.width:
+            import curses
+            raise curses.error("addstr() returned ERR")
+        row = self.rows[y]
+        end = min(x + len(string), self.width)
+        row[x:end] = string[:end - x]
+
+    def refresh(self):
+        if self.capture:
+            self.frames.append(self.contents())
+
+    def contents(self):
+        return [''.join(row) for row in self.rows]
+
+
+class BenchmarkFullRedraw(GUI):
+    def render(self):
+        offset = self.frame_stats.frames
+        for y in range(self.screen_height):
+            self.draw_string(
+                (0, y),
+                BENCHMARK_TEXT[(offset + y) % len(BENCHMARK_TEXT):][:self.screen_width].ljust(self.screen_width),
+                attr=(offset + y) % 2
+            )
+
+
+class BenchmarkSparse(GUI):
+    def render(self):
+        frame = self.frame_stats.frames
+        self.draw_string((0, 0), "frame {}".format(frame))
+        self.draw((frame % self.screen_width, self.screen_height // 2), '@')
+
+
+class BenchmarkText(GUI):
+    def render(self):
+        for y in range(1, self.screen_height):
+            self.draw_string((2, y), BENCHMARK_TEXT[:self.screen_width - 4])
+        self.draw_string((0, 0), "frame {}".format(self.frame_stats.frames), origin=BOTTOM_CENTER)
+
+
+BENCHMARK_TEXT = "The quick brown fox jumps over the lazy dog. " * 8
+BENCHMARKS = {
+    'full_redraw': BenchmarkFullRedraw,
+    'sparse': BenchmarkSparse,
+    'text': BenchmarkText,
+}
+
+
+def benchmark(frames=500, height=80, width=300, workloads=None):
+    """
+    Render frames of each workload on a headless screen without the
+    render thread or its sleeps and return frames per second and
+    curses calls and cells written per frame for each.
+    """
+    results = {}
+    for name in workloads or BENCHMARKS:
+        window = HeadlessWindow(height, width)
+        gui = BENCHMARKS[name]()
+        gui.screen = window
+        previous = Framebuffer()
+        render_frame(gui, previous)
+        calls = window.addstr_calls
+        cells = 0
+        start = monotonic()
+        for _ in range(frames):
+            render_frame(gui, previous)
+            cells += gui.cells_written
+        elapsed = monotonic() - start
+        results[name] = {
+            'fps': frames / elapsed,
+            'calls_per_frame': (window.addstr_calls - calls) / frames,
+            'cells_per_frame': cells / frames,
+        }
+    return results
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("--frames", type=int, default=500)
+    parser.add_argument("--height", type=int, default=80)
+    parser.add_argument("--width", type=int, default=300)
+    parser.add_argument("workloads", nargs="*", help=", ".join(BENCHMARKS))
+    args = parser.parse_args()
+
+    for name, result in benchmark(args.frames, args.height, args.width, args.workloads).items():
+        print("{:<12} {:>9.1f} fps {:>9.1f} calls/frame {:>9.1f} cells/frame".format(
+            name, result['fps'], result['calls_per_frame'], result['cells_per_frame']
+        ))
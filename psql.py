@@ -1,26 +1,366 @@
+import importlib
+import io
+import json
+import re
+import select
+import sys
 import threading
-import psycopg2
-from contextlib import contextmanager
-from collections import deque
+import traceback
+from itertools import chain, count
+from contextlib import contextmanager, asynccontextmanager
+from bisect import bisect_left
+from collections import deque, namedtuple
+from time import monotonic
+from mcollections import LRU
+
+
+class LazyModule:
+    """
+    Module that is only imported on first attribute access. Submodules
+    can be reached as attributes without importing them first.
+    """
+    def __init__(self, name):
+        self.__name__ = name
+
+    def __getattr__(self, attr):
+        module = importlib.import_module(self.__name__)
+        try:
+            value = getattr(module, attr)
+        except AttributeError:
+            value = importlib.import_module("{}.{}".format(self.__name__, attr))
+        setattr(self, attr, value)
+        return value
+
+
+# Only needed once connected, or by the async and Future based APIs
+psycopg2 = LazyModule('psycopg2')
+asyncio = LazyModule('asyncio')
+futures = LazyModule('concurrent.futures')
+
+# Overflow policies for a full write queue
+BLOCK = 0
+DROP = 1
+RAISE = 2
+
+
+class WriteQueueFull(Exception):
+    pass
+
+
+STREAM_IDS = count()
+SQL_LITERAL_PATTERN = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b|%\(\w+\)s|%s")
+SQL_LIST_PATTERN = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+SQL_SPACE_PATTERN = re.compile(r"\s+")
+SQL_TABLE = r'(?:"[^"]+"|\w+)(?:\.(?:"[^"]+"|\w+))?'
+SQL_TABLE_PATTERN = re.compile(SQL_TABLE)
+SQL_READ_TABLES_PATTERN = re.compile(
+    r'\b(?:FROM|JOIN)\s+({0}(?:\s+(?:AS\s+)?\w+)?(?:\s*,\s*{0}(?:\s+(?:AS\s+)?\w+)?)*)'.format(SQL_TABLE),
+    re.I
+)
+SQL_WRITE_TABLES_PATTERN = re.compile(
+    r'\b(?:INSERT\s+INTO|UPDATE|DELETE\s+FROM|TRUNCATE(?:\s+TABLE)?|(?:ALTER|DROP)\s+TABLE(?:\s+IF\s+EXISTS)?|COPY)'
+    r'\s+(?:ONLY\s+)?({})'.format(SQL_TABLE),
+    re.I
+)
+# Upper bounds in seconds of the latency histogram buckets
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0
+)
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\',
+    '\t': '\\t',
+    '\n': '\\n',
+    '\r': '\\r'
+})
+
+
+CopyResultFields = ('rows', 'seconds')
+class CopyResult(namedtuple("CopyResult", CopyResultFields)):
+    @property
+    def rows_per_second(self):
+        return self.rows / self.seconds if self.seconds else 0.0
+
+
+class CopyError(Exception):
+    """
+    Raised by PSQL.copy when a chunk fails, with the number of rows the
+    earlier chunks already committed. The original error is the cause.
+    """
+    def __init__(self, message, rows):
+        super().__init__(message)
+        self.rows = rows
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    """
+    Bounded, thread-safe pool of psycopg2 connections. Connections are
+    checked for health on checkout and recycled after max_uses checkouts
+    or after sitting idle for max_idle seconds. connect is called like
+    psycopg2.connect, the default, and may return any connection-like
+    stand-in instead.
+    """
+    def __init__(self, connection_string, *,
+                min_size=1,
+                max_size=8,
+                timeout=30.0,
+                max_uses=None,
+                max_idle=None,
+                ping=False,
+                cursor_factory=None,
+                metrics=None,
+                connect=None
+            ):
+        self.connection_string = connection_string
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.ping = ping
+        self.cursor_factory = cursor_factory
+        self.metrics = metrics
+        self.connector = connect or psycopg2.connect
+        self.condition = threading.Condition()
+        # Idle entries are [connection, uses, last_used]
+        self.idle = deque()
+        self.size = 0
+        self.closed = False
+        for _ in range(min_size):
+            self.idle.append([self.connect(), 0, monotonic()])
+            self.size += 1
+
+    def connect(self):
+        return self.connector(self.connection_string, cursor_factory=self.cursor_factory)
+
+    def __repr__(self):
+        return "{}(size={}, idle={}, max_size={})".format(
+            type(self).__name__,
+            self.size,
+            len(self.idle),
+            self.max_size
+        )
+
+    @contextmanager
+    def connection(self):
+        if self.metrics is not None:
+            start = monotonic()
+            entry = self.checkout()
+            self.metrics.record('read_wait', monotonic() - start)
+        else:
+            entry = self.checkout()
+        try:
+            yield entry[0]
+        finally:
+            self.checkin(entry)
+
+    def checkout(self):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        while True:
+            entry = None
+            with self.condition:
+                while True:
+                    if self.closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    elif self.idle:
+                        entry = self.idle.pop()
+                        break
+                    elif self.size < self.max_size:
+                        self.size += 1
+                        break
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout("Timed out waiting for a connection")
+                    self.condition.wait(remaining)
+
+            if entry is None:
+                try:
+                    return [self.connect(), 1, monotonic()]
+                except BaseException:
+                    self.discard(None)
+                    raise
+            elif self.usable(entry):
+                entry[1] += 1
+                return entry
+            else:
+                self.discard(entry[0])
+
+    def checkin(self, entry):
+        connection = entry[0]
+        try:
+            if not connection.closed and connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                connection.rollback()
+        except psycopg2.Error:
+            pass
+        if connection.closed or self.closed or (self.max_uses and entry[1] >= self.max_uses):
+            self.discard(connection)
+            return
+        entry[2] = monotonic()
+        with self.condition:
+            self.idle.append(entry)
+            self.condition.notify()
+
+    def usable(self, entry):
+        connection, uses, last_used = entry
+        if connection.closed:
+            return False
+        if self.max_idle is not None and monotonic() - last_used > self.max_idle:
+            return False
+        if connection.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if self.ping:
+            try:
+                # In autocommit the ping leaves no transaction to roll back
+                connection.autocommit = True
+                try:
+                    with connection.cursor() as cur:
+                        cur.execute("SELECT 1")
+                finally:
+                    connection.autocommit = False
+            except psycopg2.Error:
+                return False
+        return True
+
+    def discard(self, connection):
+        if connection is not None and not connection.closed:
+            try:
+                connection.close()
+            except psycopg2.Error:
+                pass
+        with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, deque()
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection, uses, last_used in idle:
+            connection.close()
+
 
 class PSQL:
-    def __init__(self, connection_string):
+    def __init__(self, connection_string, *,
+                batch_size=500,
+                batch_window=0.0,
+                pool_min_size=1,
+                pool_max_size=8,
+                pool_timeout=30.0,
+                pool_max_uses=None,
+                pool_max_idle=None,
+                pool_ping=False,
+                max_pending=None,
+                overflow=BLOCK,
+                instrument=False,
+                slow_query_threshold=None,
+                slow_query=None,
+                cache_size=None,
+                cache_ttl=60.0,
+                connect=None
+            ):
         self.running = True
         self.write_semaphore = threading.Semaphore(0)
         self.write_lock = threading.Lock()
+        self.write_connection_lock = threading.RLock()
+        self.write_condition = threading.Condition(self.write_lock)
         self.pending_writes = deque()
+        # Writes queued or in flight, and the bound on queued writes
+        self.unfinished_writes = 0
+        self.max_pending = max_pending
+        self.overflow = overflow
+        # Group commit configuration
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.write_stats = WriteStats()
+        # Instrumentation, cursors are only timed while it is enabled
+        if slow_query is not None:
+            self.slow_query = slow_query
+        if instrument:
+            # Looked up on every report so slow_query can be reassigned
+            self.metrics = Metrics(slow_query_threshold, lambda *args: self.slow_query(*args))
+            cursor_factory = self.metrics.cursor_factory()
+        else:
+            self.metrics = None
+            cursor_factory = None
+        # Opt-in read-through cache of query results
+        self.cache = QueryCache(cache_size, cache_ttl) if cache_size else None
+        self.listener = None
         # Open connectons to DB
-        self.read_connection = psycopg2.connect(connection_string)
-        self.write_connection = psycopg2.connect(connection_string)
+        self.pool = ConnectionPool(
+            connection_string,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_uses=pool_max_uses,
+            max_idle=pool_max_idle,
+            ping=pool_ping,
+            cursor_factory=cursor_factory,
+            metrics=self.metrics,
+            connect=connect
+        )
+        self.read_connection_lock = threading.Lock()
+        self.dedicated_read_connection = None
+        self.write_connection = self.pool.connector(connection_string, cursor_factory=cursor_factory)
         # Start worker thread
         self.worker = threading.Thread(target=sql_write_worker, args=(self,), daemon=True)
         self.worker.start()
 
-    def close(self):
+    def close(self, drain=True):
+        """
+        Stop the write worker and close all connections. With drain, wait
+        for every queued write to commit first, otherwise queued writes
+        are cancelled.
+        """
+        if drain:
+            self.flush()
         self.running = False
-        self.read_connection.close()
-        self.write_connection.close()
         self.worker.join()
+        if self.listener is not None:
+            self.listener.join()
+        with self.write_lock:
+            cancelled, self.pending_writes = self.pending_writes, deque()
+            self.unfinished_writes -= len(cancelled)
+            self.write_condition.notify_all()
+        for args, kwargs, future in cancelled:
+            future.cancel()
+        self.pool.close()
+        if self.dedicated_read_connection is not None:
+            self.dedicated_read_connection.close()
+        self.write_connection.close()
+
+    @property
+    def read_connection(self):
+        """
+        Connection outside the pool for callers that used the single read
+        connection directly, opened on first use. Prefer read_cursor.
+        """
+        with self.read_connection_lock:
+            if self.dedicated_read_connection is None:
+                self.dedicated_read_connection = self.pool.connector(
+                    self.pool.connection_string,
+                    cursor_factory=self.pool.cursor_factory
+                )
+            return self.dedicated_read_connection
+
+    def flush(self, timeout=None):
+        """
+        Block until every write queued so far has been committed or has
+        failed. Returns False if the timeout expired first.
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.write_lock:
+            while self.unfinished_writes and self.worker.is_alive():
+                remaining = 1 if deadline is None else min(1, deadline - monotonic())
+                if remaining <= 0:
+                    return False
+                self.write_condition.wait(remaining)
+        return not self.unfinished_writes
 
     def __enter__(self, *args, **kwargs):
         return self
@@ -29,33 +369,64 @@ class PSQL:
         self.close()
 
     @contextmanager
-    def read_write_cursor(self):
-        cur = self.read_connection.cursor()
-        try:
-            yield cur
-        finally:
-            cur.close()
-            self.read_connection.commit()
+    def read_write_cursor(self, tables=None):
+        """
+        Cursor on a pooled connection that is committed on exit. With the
+        cache enabled, cached results reading tables are invalidated after
+        the commit, or the whole cache if tables is None.
+        """
+        with self.pool.connection() as connection:
+            cur = connection.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+                connection.commit()
+                if self.metrics is not None:
+                    self.metrics.count('commits')
+                if self.cache is not None:
+                    self.cache.invalidate(tables)
 
     @contextmanager
-    def write_cursor(self):
-        cur = self.write_connection.cursor()
-        try:
-            yield cur
-        finally:
-            cur.close()
-            self.write_connection.commit()
+    def write_cursor(self, tables=None):
+        """
+        Cursor on the write connection that is committed on exit. tables
+        is handled as for read_write_cursor.
+        """
+        with self.write_connection_lock:
+            cur = self.write_connection.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+                self.write_connection.commit()
+                if self.metrics is not None:
+                    self.metrics.count('commits')
+                if self.cache is not None:
+                    self.cache.invalidate(tables)
 
     @contextmanager
     def read_cursor(self):
-        cur = self.read_connection.cursor()
-        try:
-            yield cur
-        finally:
-            cur.close()
+        """
+        Cursor on a pooled connection in autocommit, so reads don't open
+        a transaction that has to be rolled back on checkin.
+        """
+        with self.pool.connection() as connection:
+            connection.autocommit = True
+            cur = connection.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+                if not connection.closed:
+                    connection.autocommit = False
 
     def execute_and_return(self, *args, **kwargs):
-        with self.read_write_cursor() as cur:
+        tables = None
+        if self.cache is not None:
+            # Unrecognised writes, e.g. function calls, clear everything
+            tables = written_tables(sql_text(statement_of(args, kwargs), self.write_connection)) or None
+        with self.read_write_cursor(tables) as cur:
             cur.execute(*args, **kwargs)
             result = cur.fetchone()
             if result and len(result) == 1:
@@ -64,16 +435,200 @@ class PSQL:
                 return result
 
     def execute(self, *args, **kwargs):
+        """
+        Queue a write and return a Future that resolves once it has been
+        committed, or raises the error it failed with.
+        """
+        future = futures.Future()
+        if self.metrics is not None:
+            future.queued_at = monotonic()
         with self.write_lock:
-            self.pending_writes.append((args, kwargs))
+            if self.max_pending is not None:
+                while len(self.pending_writes) >= self.max_pending:
+                    if self.overflow == DROP:
+                        future.cancel()
+                        return future
+                    elif self.overflow == RAISE:
+                        raise WriteQueueFull("{} writes pending".format(len(self.pending_writes)))
+                    self.write_condition.wait()
+            self.pending_writes.append((args, kwargs, future))
+            self.unfinished_writes += 1
         self.write_semaphore.release()
+        return future
+
+    def copy(self, table, data, columns=None, *, chunk_size=10000, header=False):
+        """
+        Bulk load data into table with COPY FROM STDIN on the write
+        connection. data is an iterable of tuples or dicts (columns default
+        to the keys of the first dict), or a text file-like object of CSV
+        rows, optionally starting with a header row. Rows are sent and
+        committed chunk_size at a time so queued writes only wait for one
+        chunk. Returns a CopyResult.
+
+        The load is not atomic: if a chunk fails, the chunks before it stay
+        committed and a CopyError is raised with their row count in rows.
+        """
+        start = monotonic()
+        if hasattr(data, 'read'):
+            chunks = csv_chunks(data, chunk_size, header)
+            options = "FORMAT csv"
+        else:
+            rows = iter(data)
+            first = next(rows, None)
+            if first is None:
+                return CopyResult(0, 0.0)
+            if isinstance(first, dict) and columns is None:
+                columns = list(first)
+            chunks = row_chunks(first, rows, columns, chunk_size)
+            options = "FORMAT text"
+
+        statement = psycopg2.sql.SQL("COPY {} {} FROM STDIN WITH ({})").format(
+            psycopg2.sql.Identifier(*table.split('.')),
+            psycopg2.sql.SQL("({})").format(
+                psycopg2.sql.SQL(", ").join(map(psycopg2.sql.Identifier, columns))
+            ) if columns else psycopg2.sql.SQL(""),
+            psycopg2.sql.SQL(options)
+        ).as_string(self.write_connection)
+
+        total = 0
+        try:
+            for text, rows in chunks:
+                with self.write_connection_lock:
+                    try:
+                        with self.write_connection.cursor() as cur:
+                            cur.copy_expert(statement, io.StringIO(text))
+                        self.write_connection.commit()
+                        if self.metrics is not None:
+                            self.metrics.count('commits')
+                        if self.cache is not None:
+                            self.cache.invalidate((table_key(table),))
+                    except BaseException:
+                        self.write_connection.rollback()
+                        raise
+                total += rows
+        except Exception as e:
+            raise CopyError(
+                "COPY into {} failed after {} rows were committed: {}".format(table, total, e),
+                total
+            ) from e
+        return CopyResult(total, monotonic() - start)
+
+    def slow_query(self, sql, params, seconds):
+        """
+        Called with instrumentation enabled when a statement takes at
+        least slow_query_threshold seconds.
+        """
+        pass
+
+    def snapshot(self):
+        """
+        Return a dict of the current write queue gauges and write stats,
+        plus statement timings and counters if instrumentation is enabled.
+        """
+        with self.write_lock:
+            depth = len(self.pending_writes)
+            oldest = self.pending_writes[0][2] if depth else None
+        snapshot = {
+            'queue_depth': depth,
+            'unfinished_writes': self.unfinished_writes,
+            'pool_size': self.pool.size,
+            'pool_idle': len(self.pool.idle),
+            'batches': self.write_stats.batches,
+            'batch_size_mean': self.write_stats.mean_batch_size,
+            'batch_size_max': self.write_stats.max_batch_size,
+            'commit_latency_mean': self.write_stats.mean_commit_latency,
+            'write_failures': self.write_stats.failures,
+        }
+        if self.metrics is not None:
+            snapshot['oldest_write_age'] = monotonic() - oldest.queued_at if oldest else 0.0
+            snapshot.update(self.metrics.snapshot())
+        return snapshot
 
-    def query(self, *args, **kwargs):
+    def write_failed(self, args, kwargs, error):
+        """
+        Called from the write worker when a queued statement fails, after
+        its future has been given the error. The rest of its batch is
+        still committed.
+        """
+        print("PSQL write failed: {}".format(args[0] if args else kwargs), file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    def query(self, *args, cache=False, tables=None, **kwargs):
+        """
+        Run a query and return all rows. With cache (and the cache
+        enabled) the result is served from and stored in the query cache,
+        tagged with tables or the tables named in the sql.
+        """
+        if cache and self.cache is not None:
+            return list(self.cached(self.query, args, kwargs, tables))
         with self.read_cursor() as cur:
             cur.execute(*args, **kwargs)
             return cur.fetchall()
 
-    def single_query(self, *args, **kwargs):
+    def cached(self, method, args, kwargs, tables):
+        key = (method.__name__, args, tuple(kwargs.items()))
+        try:
+            hash(key)
+        except TypeError:
+            key = repr(key)
+        value = self.cache.get(key)
+        if value is not MISSING:
+            return value
+        if tables is None:
+            tables = read_tables(sql_text(statement_of(args, kwargs), self.write_connection))
+        else:
+            tables = tuple(table_key(table) for table in tables)
+        versions = self.cache.versions(tables)
+        value = method(*args, **kwargs)
+        self.cache.put(key, tables, versions, value)
+        return value
+
+    def listen(self, channel="psql_cache"):
+        """
+        Invalidate the query cache on Postgres NOTIFY events on channel,
+        with a payload of comma separated table names, or an empty payload
+        to clear the whole cache. Useful when other processes write to
+        cached tables, e.g. from a trigger calling
+        pg_notify('psql_cache', TG_TABLE_NAME). Only one listener can run
+        per PSQL.
+        """
+        if self.cache is None:
+            raise ValueError("listen() needs the query cache, pass cache_size")
+        if self.listener is not None:
+            raise RuntimeError("Already listening for cache invalidations")
+        self.listener = threading.Thread(
+            target=sql_listen_worker,
+            args=(self, self.pool.connector(self.pool.connection_string), channel),
+            daemon=True
+        )
+        self.listener.start()
+
+    def stream(self, *args, chunk_size=2000, batches=False, **kwargs):
+        """
+        Run a query through a named server-side cursor and yield its rows,
+        or lists of up to chunk_size rows with batches, fetching chunk_size
+        rows at a time. A pooled connection is held until the generator is
+        exhausted or closed.
+        """
+        with self.pool.connection() as connection:
+            cur = connection.cursor(name="psql_stream_{}".format(next(STREAM_IDS)))
+            cur.itersize = chunk_size
+            try:
+                cur.execute(*args, **kwargs)
+                while True:
+                    rows = cur.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    if batches:
+                        yield rows
+                    else:
+                        yield from rows
+            finally:
+                cur.close()
+
+    def single_query(self, *args, cache=False, tables=None, **kwargs):
+        if cache and self.cache is not None:
+            return self.cached(self.single_query, args, kwargs, tables)
         with self.read_cursor() as cur:
             cur.execute(*args, **kwargs)
             result = cur.fetchone()
@@ -83,15 +638,1077 @@ class PSQL:
                 return result
 
 
+MISSING = object()
+
+
+class QueryCache:
+    """
+    Bounded LRU cache of query results with a TTL. Entries are tagged
+    with the tables they read, and invalidating a table drops its entries
+    and bumps its version so reads that started before the invalidation
+    are not stored.
+    """
+    def __init__(self, maxsize=1024, ttl=60.0):
+        self.lock = threading.Lock()
+        self.ttl = ttl
+        self.entries = LRU(maxsize)
+        self.tagged = {}
+        self.table_versions = {}
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __repr__(self):
+        return "{}(entries={}, hits={}, misses={})".format(
+            type(self).__name__,
+            len(self.entries),
+            self.hits,
+            self.misses
+        )
+
+    def get(self, key):
+        with self.lock:
+            try:
+                expires, tables, value = self.entries[key]
+            except KeyError:
+                self.misses += 1
+                return MISSING
+            if self.ttl is not None and expires < monotonic():
+                self.entries.pop(key)
+                self.misses += 1
+                return MISSING
+            self.hits += 1
+            return value
+
+    def versions(self, tables):
+        with self.lock:
+            return (self.generation,) + tuple(self.table_versions.get(table, 0) for table in tables)
+
+    def put(self, key, tables, versions, value):
+        with self.lock:
+            if versions != (self.generation,) + tuple(self.table_versions.get(table, 0) for table in tables):
+                return
+            expires = None if self.ttl is None else monotonic() + self.ttl
+            self.entries[key] = (expires, tables, value)
+            for table in tables:
+                keys = self.tagged.setdefault(table, set())
+                keys.add(key)
+                # Drop tags of entries the LRU has already evicted
+                if len(keys) > self.entries.maxsize:
+                    keys.intersection_update(self.entries)
+
+    def invalidate(self, tables=None):
+        """
+        Drop the entries reading any of tables, or everything if tables
+        is None.
+        """
+        with self.lock:
+            if tables is None:
+                self.generation += 1
+                self.entries.clear()
+                self.tagged.clear()
+                return
+            for table in tables:
+                self.table_versions[table] = self.table_versions.get(table, 0) + 1
+                for key in self.tagged.pop(table, ()):
+                    self.entries.pop(key)
+
+
+def statement_of(args, kwargs):
+    return args[0] if args else kwargs.get('query')
+
+
+def sql_text(sql, context):
+    if isinstance(sql, str):
+        return sql
+    elif isinstance(sql, bytes):
+        return sql.decode()
+    elif isinstance(sql, psycopg2.sql.Composable):
+        return sql.as_string(context)
+    else:
+        return str(sql)
+
+
+def table_key(table):
+    """
+    Cache tag of a possibly schema qualified and quoted table name.
+    """
+    name = table.rsplit('.', 1)[-1]
+    if name.startswith('"'):
+        return name.strip('"')
+    return name.lower()
+
+
+def read_tables(sql):
+    tables = set()
+    for match in SQL_READ_TABLES_PATTERN.finditer(sql):
+        for item in match.group(1).split(','):
+            tables.add(table_key(SQL_TABLE_PATTERN.match(item.strip()).group(0)))
+    return tuple(tables)
+
+
+def written_tables(sql):
+    return tuple(set(
+        table_key(match.group(1)) for match in SQL_WRITE_TABLES_PATTERN.finditer(sql)
+    ))
+
+
+def sql_listen_worker(psql, connection, channel):
+    connection.autocommit = True
+    with connection.cursor() as cur:
+        cur.execute(psycopg2.sql.SQL("LISTEN {}").format(psycopg2.sql.Identifier(channel)))
+    try:
+        while psql.running:
+            if not select.select([connection], [], [], 1)[0]:
+                continue
+            connection.poll()
+            while connection.notifies:
+                payload = connection.notifies.pop(0).payload
+                if payload:
+                    psql.cache.invalidate([table_key(table.strip()) for table in payload.split(',')])
+                else:
+                    psql.cache.invalidate()
+    finally:
+        connection.close()
+
+
+def normalize_sql(sql):
+    """
+    Reduce a statement to its shape by replacing literals and parameters
+    with ? and collapsing whitespace.
+    """
+    sql = SQL_LITERAL_PATTERN.sub('?', sql)
+    sql = SQL_LIST_PATTERN.sub('(?)', sql)
+    return SQL_SPACE_PATTERN.sub(' ', sql).strip()
+
+
+class Histogram:
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        # The last count is for values above every bucket
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.total / self.count if self.count else 0.0,
+            'max': self.max,
+            'buckets': dict(zip(self.buckets + (float('inf'),), self.counts))
+        }
+
+
+class Metrics:
+    """
+    Statement timing histograms keyed by normalized sql, pool wait and
+    write lag histograms and commit/error counters for an instrumented
+    PSQL.
+    """
+    def __init__(self, slow_query_threshold=None, slow_query=None, max_statements=1000):
+        self.lock = threading.Lock()
+        self.slow_query_threshold = slow_query_threshold
+        self.slow_query = slow_query
+        self.normalized = LRU(max_statements)
+        self.statements = LRU(max_statements)
+        self.read_wait = Histogram()
+        self.write_lag = Histogram()
+        self.counters = {'statements': 0, 'errors': 0, 'commits': 0}
+
+    def cursor_factory(self):
+        return type('TimedCursor', (TimedCursor, psycopg2.extensions.cursor), {'metrics': self})
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] += amount
+
+    def record(self, name, seconds):
+        with self.lock:
+            getattr(self, name).observe(seconds)
+
+    def observe(self, sql, params, seconds, error, statements=1):
+        if not isinstance(sql, str):
+            sql = sql.decode() if isinstance(sql, bytes) else str(sql)
+        with self.lock:
+            try:
+                key = self.normalized[sql]
+            except KeyError:
+                key = self.normalized[sql] = normalize_sql(sql)
+            try:
+                histogram = self.statements[key]
+            except KeyError:
+                histogram = self.statements[key] = Histogram()
+            histogram.observe(seconds)
+            self.counters['statements'] += statements
+            if error:
+                self.counters['errors'] += 1
+        if self.slow_query_threshold is not None and seconds >= self.slow_query_threshold:
+            self.slow_query(sql, params, seconds)
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                'counters': dict(self.counters),
+                'read_wait': self.read_wait.snapshot(),
+                'write_lag': self.write_lag.snapshot(),
+                'statements': {
+                    key: histogram.snapshot()
+                    for key, histogram in self.statements.items()
+                }
+            }
+
+
+class TimedCursor:
+    """
+    Mixin for psycopg2 cursors, see Metrics.cursor_factory. Statements
+    are not timed while timed is False.
+    """
+    metrics = None
+    timed = True
+
+    def execute(self, query, vars=None):
+        if not self.timed:
+            return super().execute(query, vars)
+        start = monotonic()
+        error = True
+        try:
+            result = super().execute(query, vars)
+            error = False
+            return result
+        finally:
+            if isinstance(query, psycopg2.sql.Composable):
+                query = query.as_string(self)
+            self.metrics.observe(query, vars, monotonic() - start, error)
+
+    def executemany(self, query, vars_list):
+        start = monotonic()
+        error = True
+        try:
+            result = super().executemany(query, vars_list)
+            error = False
+            return result
+        finally:
+            if isinstance(query, psycopg2.sql.Composable):
+                query = query.as_string(self)
+            self.metrics.observe(query, None, monotonic() - start, error)
+
+
+class WriteStats:
+    def __init__(self):
+        self.batches = 0
+        self.statements = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.last_commit_latency = 0.0
+        self.total_commit_latency = 0.0
+
+    def __repr__(self):
+        return "{}(batches={}, statements={}, failures={}, mean_batch_size={:.1f}, mean_commit_latency={:.6f})".format(
+            type(self).__name__,
+            self.batches,
+            self.statements,
+            self.failures,
+            self.mean_batch_size,
+            self.mean_commit_latency
+        )
+
+    @property
+    def mean_batch_size(self):
+        return self.statements / self.batches if self.batches else 0.0
+
+    @property
+    def mean_commit_latency(self):
+        return self.total_commit_latency / self.batches if self.batches else 0.0
+
+    def record(self, size, failures, latency):
+        self.batches += 1
+        self.statements += size
+        self.failures += failures
+        self.last_batch_size = size
+        self.max_batch_size = max(self.max_batch_size, size)
+        self.last_commit_latency = latency
+        self.total_commit_latency += latency
+
+
+def copy_field(value):
+    if value is None:
+        return '\\N'
+    return copy_text(value).translate(COPY_ESCAPES)
+
+
+def copy_text(value):
+    """
+    Postgres text input form of a value: bytes as bytea hex, dicts and
+    psycopg2.extras.Json values as JSON, lists and tuples as array
+    literals and other scalars as str() does.
+    """
+    if isinstance(value, str):
+        return value
+    elif isinstance(value, (bytes, bytearray, memoryview)):
+        return '\\x' + bytes(value).hex()
+    elif isinstance(value, dict):
+        return json.dumps(value)
+    elif isinstance(value, (list, tuple)):
+        return '{' + ','.join(map(array_element, value)) + '}'
+    elif isinstance(value, (set, frozenset)):
+        raise TypeError("Can't COPY a {}, use a list for arrays".format(type(value).__name__))
+    elif isinstance(value, psycopg2.extras.Json):
+        return value.dumps(value.adapted)
+    return str(value)
+
+
+def array_element(value):
+    if value is None:
+        return 'NULL'
+    elif isinstance(value, (list, tuple)):
+        return copy_text(value)
+    return '"' + copy_text(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def row_chunks(first, rows, columns, chunk_size):
+    """
+    Yield (text, row_count) chunks of COPY text format data.
+    """
+    lines = []
+    for row in chain((first,), rows):
+        if isinstance(row, dict):
+            row = [row.get(column) for column in columns]
+        lines.append('\t'.join(map(copy_field, row)))
+        if len(lines) >= chunk_size:
+            yield '\n'.join(lines) + '\n', len(lines)
+            lines = []
+    if lines:
+        yield '\n'.join(lines) + '\n', len(lines)
+
+
+def csv_chunks(stream, chunk_size, header):
+    """
+    Yield (text, row_count) chunks of whole CSV rows read from stream. A
+    row continues across lines while it has an unbalanced quote.
+    """
+    lines = []
+    row = []
+    quotes = 0
+    for line in stream:
+        row.append(line)
+        quotes += line.count('"')
+        if quotes % 2:
+            continue
+        if header:
+            header = False
+        else:
+            lines.append(''.join(row))
+        row = []
+        quotes = 0
+        if len(lines) >= chunk_size:
+            yield ''.join(lines), len(lines)
+            lines = []
+    if row:
+        lines.append(''.join(row))
+    if lines:
+        yield ''.join(lines), len(lines)
+
+
 def sql_write_worker(psql):
     while psql.running:
-        psql.write_semaphore.acquire(timeout=1)
+        if not psql.write_semaphore.acquire(timeout=1):
+            continue
+
+        # Drain everything pending, then optionally wait out the batch
+        # window for more statements to join the transaction
+        batch = drain_writes(psql, psql.batch_size)
+        if psql.batch_window:
+            deadline = monotonic() + psql.batch_window
+            while len(batch) < psql.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0 or not psql.write_semaphore.acquire(timeout=remaining):
+                    break
+                batch.extend(drain_writes(psql, psql.batch_size - len(batch)))
+
+        if batch:
+            with psql.write_connection_lock:
+                write_batch(psql, batch)
+
+
+def drain_writes(psql, limit):
+    with psql.write_lock:
+        count = min(limit, len(psql.pending_writes))
+        batch = []
+        for _ in range(count):
+            entry = psql.pending_writes.popleft()
+            # Writes whose future was cancelled while queued are skipped
+            if entry[2].set_running_or_notify_cancel():
+                batch.append(entry)
+            else:
+                psql.unfinished_writes -= 1
+        if count:
+            psql.write_condition.notify_all()
+    # The caller already holds one permit, consume the rest
+    for _ in range(count - 1):
+        psql.write_semaphore.acquire(blocking=False)
+    return batch
 
-        args = None
+
+def group_writes(batch):
+    """
+    Yield (args, kwargs, params_list) for each statement in the batch,
+    merging consecutive (sql, params) statements with the same sql text
+    into a single entry.
+    """
+    group = None
+    for args, kwargs, future in batch:
+        if group and group[2] is not None and not kwargs and len(args) == 2 and args[0] == group[0][0]:
+            group[2].append(args[1])
+            continue
+        if group:
+            yield group
+        if not kwargs and len(args) == 2:
+            group = (args, kwargs, [args[1]])
+        else:
+            group = (args, kwargs, None)
+    if group:
+        yield group
+
+
+def write_batch(psql, batch):
+    connection = psql.write_connection
+    start = monotonic()
+    failures = 0
+    try:
+        try:
+            with connection.cursor() as cur:
+                for args, kwargs, params_list in group_writes(batch):
+                    if params_list and len(params_list) > 1:
+                        execute_group(psql, cur, args[0], params_list)
+                    else:
+                        cur.execute(*args, **kwargs)
+            connection.commit()
+        except Exception:
+            # Replay the batch one statement at a time to isolate the failure
+            connection.rollback()
+            failures = write_isolated(psql, batch)
+        else:
+            invalidate_written(psql, batch)
+            for args, kwargs, future in batch:
+                future.set_result(None)
+        if psql.metrics is not None:
+            psql.metrics.count('commits')
+            psql.metrics.record('write_lag', monotonic() - batch[0][2].queued_at)
+    except Exception as e:
+        # The connection itself failed, nothing in the batch was committed
+        for args, kwargs, future in batch:
+            if not future.done():
+                future.set_exception(e)
+                failures += 1
+    finally:
         with psql.write_lock:
-            if psql.pending_writes:
-                args, kwargs = psql.pending_writes.popleft()
+            psql.unfinished_writes -= len(batch)
+            psql.write_condition.notify_all()
+    psql.write_stats.record(len(batch), failures, monotonic() - start)
+
+
+def execute_group(psql, cur, sql, params_list):
+    """
+    Run sql once per params with execute_batch. With instrumentation
+    the group is timed as a whole under sql's own key rather than under
+    the pages of joined statements execute_batch sends.
+    """
+    if psql.metrics is None:
+        psycopg2.extras.execute_batch(cur, sql, params_list)
+        return
+    start = monotonic()
+    error = True
+    cur.timed = False
+    try:
+        psycopg2.extras.execute_batch(cur, sql, params_list)
+        error = False
+    finally:
+        cur.timed = True
+        psql.metrics.observe(
+            sql_text(sql, cur), None, monotonic() - start, error, len(params_list)
+        )
+
 
-        if args:
-            with psql.write_cursor() as cur:
+def write_isolated(psql, batch):
+    connection = psql.write_connection
+    failures = 0
+    committed = []
+    with connection.cursor() as cur:
+        for args, kwargs, future in batch:
+            cur.execute("SAVEPOINT sql_write")
+            try:
                 cur.execute(*args, **kwargs)
+            except Exception as e:
+                cur.execute("ROLLBACK TO SAVEPOINT sql_write")
+                failures += 1
+                future.set_exception(e)
+                psql.write_failed(args, kwargs, e)
+            else:
+                cur.execute("RELEASE SAVEPOINT sql_write")
+                committed.append((args, kwargs, future))
+    connection.commit()
+    invalidate_written(psql, committed)
+    for args, kwargs, future in committed:
+        future.set_result(None)
+    return failures
+
+
+def invalidate_written(psql, batch):
+    """
+    Drop the cached results a committed batch may have changed, before
+    its futures resolve. Statements whose tables aren't recognised,
+    such as function calls, clear the whole cache.
+    """
+    if psql.cache is None:
+        return
+    tables = set()
+    for args, kwargs, future in batch:
+        written = written_tables(sql_text(statement_of(args, kwargs), psql.write_connection))
+        if not written:
+            psql.cache.invalidate(None)
+            return
+        tables.update(written)
+    psql.cache.invalidate(tables)
+
+
+async def wait_ready(connection):
+    """
+    Poll an async mode psycopg2 connection until its pending operation is
+    complete, yielding to the event loop while the socket is not ready.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        state = connection.poll()
+        if state == psycopg2.extensions.POLL_OK:
+            return
+        elif state == psycopg2.extensions.POLL_READ:
+            add, remove = loop.add_reader, loop.remove_reader
+        elif state == psycopg2.extensions.POLL_WRITE:
+            add, remove = loop.add_writer, loop.remove_writer
+        else:
+            raise psycopg2.OperationalError("Unexpected poll state {}".format(state))
+
+        ready = loop.create_future()
+        fd = connection.fileno()
+        add(fd, lambda: ready.done() or ready.set_result(None))
+        try:
+            await ready
+        finally:
+            remove(fd)
+
+
+class AsyncCursor:
+    """
+    Wrapper around a cursor of an async mode connection. execute is a
+    coroutine, the fetch methods read the already received results.
+    """
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    async def execute(self, *args, **kwargs):
+        self.cursor.execute(*args, **kwargs)
+        await wait_ready(self.cursor.connection)
+
+
+class AsyncConnection:
+    """
+    Async mode psycopg2 connection. Any object with the same cursor,
+    closed, executing, transaction_status and close members can be
+    returned by the connect coroutine given to AsyncConnectionPool and
+    AsyncPSQL instead.
+    """
+    def __init__(self, connection):
+        self.connection = connection
+
+    @classmethod
+    async def connect(cls, connection_string):
+        connection = psycopg2.connect(connection_string, async_=True)
+        await wait_ready(connection)
+        return cls(connection)
+
+    @property
+    def closed(self):
+        return self.connection.closed
+
+    @property
+    def executing(self):
+        return self.connection.isexecuting()
+
+    @property
+    def transaction_status(self):
+        return self.connection.get_transaction_status()
+
+    def cursor(self):
+        return AsyncCursor(self.connection.cursor())
+
+    def close(self):
+        self.connection.close()
+
+
+class AsyncConnectionPool:
+    """
+    asyncio counterpart of ConnectionPool.
+    """
+    def __init__(self, connection_string, *,
+                min_size=1,
+                max_size=8,
+                timeout=30.0,
+                max_uses=None,
+                max_idle=None,
+                ping=False,
+                connect=AsyncConnection.connect
+            ):
+        self.connection_string = connection_string
+        self.min_size = min_size
+        self.max_size = max(max_size, min_size, 1)
+        self.timeout = timeout
+        self.max_uses = max_uses
+        self.max_idle = max_idle
+        self.ping = ping
+        self.connect = connect
+        self.condition = None
+        # Idle entries are [connection, uses, last_used]
+        self.idle = deque()
+        self.size = 0
+        self.closed = False
+
+    def __repr__(self):
+        return "{}(size={}, idle={}, max_size={})".format(
+            type(self).__name__,
+            self.size,
+            len(self.idle),
+            self.max_size
+        )
+
+    async def open(self):
+        self.condition = asyncio.Condition()
+        for _ in range(self.min_size):
+            self.idle.append([await self.connect(self.connection_string), 0, monotonic()])
+            self.size += 1
+        return self
+
+    @asynccontextmanager
+    async def connection(self):
+        entry = await self.checkout()
+        try:
+            yield entry[0]
+        finally:
+            await self.checkin(entry)
+
+    async def checkout(self):
+        deadline = None if self.timeout is None else monotonic() + self.timeout
+        while True:
+            entry = None
+            async with self.condition:
+                while True:
+                    if self.closed:
+                        raise PoolTimeout("Connection pool is closed")
+                    elif self.idle:
+                        entry = self.idle.pop()
+                        break
+                    elif self.size < self.max_size:
+                        self.size += 1
+                        break
+                    remaining = None if deadline is None else deadline - monotonic()
+                    if remaining is not None and remaining <= 0:
+                        raise PoolTimeout("Timed out waiting for a connection")
+                    try:
+                        await asyncio.wait_for(self.condition.wait(), remaining)
+                    except asyncio.TimeoutError:
+                        pass
+
+            if entry is None:
+                try:
+                    return [await self.connect(self.connection_string), 1, monotonic()]
+                except BaseException:
+                    await self.discard(None)
+                    raise
+            elif await self.usable(entry):
+                entry[1] += 1
+                return entry
+            else:
+                await self.discard(entry[0])
+
+    async def checkin(self, entry):
+        connection = entry[0]
+        if not connection.closed and connection.executing:
+            # Abandoned mid-query, e.g. by a cancelled task
+            connection.close()
+        elif not connection.closed and connection.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            try:
+                cur = connection.cursor()
+                await cur.execute("ROLLBACK")
+                cur.close()
+            except psycopg2.Error:
+                connection.close()
+        if connection.closed or self.closed or (self.max_uses and entry[1] >= self.max_uses):
+            await self.discard(connection)
+            return
+        entry[2] = monotonic()
+        async with self.condition:
+            self.idle.append(entry)
+            self.condition.notify()
+
+    async def usable(self, entry):
+        connection, uses, last_used = entry
+        if connection.closed:
+            return False
+        if self.max_idle is not None and monotonic() - last_used > self.max_idle:
+            return False
+        if connection.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if self.ping:
+            try:
+                cur = connection.cursor()
+                await cur.execute("SELECT 1")
+                cur.close()
+            except psycopg2.Error:
+                return False
+        return True
+
+    async def discard(self, connection):
+        if connection is not None and not connection.closed:
+            connection.close()
+        async with self.condition:
+            self.size -= 1
+            self.condition.notify()
+
+    async def close(self):
+        async with self.condition:
+            self.closed = True
+            idle, self.idle = self.idle, deque()
+            self.size -= len(idle)
+            self.condition.notify_all()
+        for connection, uses, last_used in idle:
+            connection.close()
+
+
+class AsyncPSQL:
+    """
+    asyncio counterpart of PSQL. Queries run on async mode connections
+    from an AsyncConnectionPool and queued writes are batched by a write
+    task instead of a thread. Must be opened with open() or async with.
+    """
+    def __init__(self, connection_string, *,
+                batch_size=500,
+                batch_window=0.0,
+                pool_min_size=1,
+                pool_max_size=8,
+                pool_timeout=30.0,
+                pool_max_uses=None,
+                pool_max_idle=None,
+                pool_ping=False,
+                max_pending=None,
+                overflow=BLOCK,
+                connect=AsyncConnection.connect
+            ):
+        self.connection_string = connection_string
+        self.running = False
+        self.connect = connect
+        # Group commit configuration
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self.write_stats = WriteStats()
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self.pool = AsyncConnectionPool(
+            connection_string,
+            min_size=pool_min_size,
+            max_size=pool_max_size,
+            timeout=pool_timeout,
+            max_uses=pool_max_uses,
+            max_idle=pool_max_idle,
+            ping=pool_ping,
+            connect=connect
+        )
+        self.pending_writes = None
+        self.write_connection = None
+        self.write_connection_lock = None
+        self.worker = None
+
+    async def open(self):
+        await self.pool.open()
+        self.write_connection = await self.connect(self.connection_string)
+        self.write_connection_lock = asyncio.Lock()
+        self.pending_writes = asyncio.Queue(self.max_pending or 0)
+        self.running = True
+        self.worker = asyncio.ensure_future(async_sql_write_worker(self))
+        return self
+
+    async def close(self, drain=True):
+        if drain:
+            await self.flush()
+        self.running = False
+        self.worker.cancel()
+        await asyncio.gather(self.worker, return_exceptions=True)
+        while not self.pending_writes.empty():
+            args, kwargs, future = self.pending_writes.get_nowait()
+            future.cancel()
+            self.pending_writes.task_done()
+        await self.pool.close()
+        self.write_connection.close()
+
+    async def flush(self, timeout=None):
+        try:
+            await asyncio.wait_for(self.pending_writes.join(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def __aenter__(self, *args, **kwargs):
+        return await self.open()
+
+    async def __aexit__(self, *args, **kwargs):
+        await self.close()
+
+    @asynccontextmanager
+    async def read_write_cursor(self):
+        async with self.pool.connection() as connection:
+            cur = connection.cursor()
+            try:
+                await cur.execute("BEGIN")
+                yield cur
+                await cur.execute("COMMIT")
+            finally:
+                cur.close()
+
+    @asynccontextmanager
+    async def write_cursor(self):
+        async with self.write_connection_lock:
+            cur = self.write_connection.cursor()
+            try:
+                await cur.execute("BEGIN")
+                try:
+                    yield cur
+                except BaseException:
+                    if not self.write_connection.executing:
+                        await cur.execute("ROLLBACK")
+                    raise
+                await cur.execute("COMMIT")
+            finally:
+                cur.close()
+
+    @asynccontextmanager
+    async def read_cursor(self):
+        async with self.pool.connection() as connection:
+            cur = connection.cursor()
+            try:
+                yield cur
+            finally:
+                cur.close()
+
+    async def execute_and_return(self, *args, **kwargs):
+        async with self.read_write_cursor() as cur:
+            await cur.execute(*args, **kwargs)
+            result = cur.fetchone()
+            if result and len(result) == 1:
+                return result[0]
+            else:
+                return result
+
+    async def execute(self, *args, **kwargs):
+        """
+        Queue a write and return an asyncio Future that resolves once it
+        has been committed, or raises the error it failed with.
+        """
+        future = asyncio.get_running_loop().create_future()
+        entry = (args, kwargs, future)
+        if self.overflow == BLOCK:
+            await self.pending_writes.put(entry)
+        else:
+            try:
+                self.pending_writes.put_nowait(entry)
+            except asyncio.QueueFull:
+                if self.overflow == RAISE:
+                    raise WriteQueueFull("{} writes pending".format(self.pending_writes.qsize()))
+                future.cancel()
+        return future
+
+    def write_failed(self, args, kwargs, error):
+        """
+        Called from the write task when a queued statement fails, after
+        its future has been given the error.
+        """
+        print("AsyncPSQL write failed: {}".format(args[0] if args else kwargs), file=sys.stderr)
+        traceback.print_exception(type(error), error, error.__traceback__)
+
+    async def query(self, *args, **kwargs):
+        async with self.read_cursor() as cur:
+            await cur.execute(*args, **kwargs)
+            return cur.fetchall()
+
+    async def single_query(self, *args, **kwargs):
+        async with self.read_cursor() as cur:
+            await cur.execute(*args, **kwargs)
+            result = cur.fetchone()
+            if result and len(result) == 1:
+                return result[0]
+            else:
+                return result
+
+
+async def async_sql_write_worker(psql):
+    queue = psql.pending_writes
+    while psql.running:
+        batch = [await queue.get()]
+        while len(batch) < psql.batch_size and not queue.empty():
+            batch.append(queue.get_nowait())
+        if psql.batch_window:
+            deadline = monotonic() + psql.batch_window
+            while len(batch) < psql.batch_size:
+                remaining = deadline - monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+        try:
+            live = [entry for entry in batch if not entry[2].done()]
+            if live:
+                async with psql.write_connection_lock:
+                    await async_write_batch(psql, live)
+        finally:
+            for _ in batch:
+                queue.task_done()
+
+
+async def async_write_batch(psql, batch):
+    start = monotonic()
+    failures = 0
+    cur = psql.write_connection.cursor()
+    try:
+        try:
+            await cur.execute("BEGIN")
+            for args, kwargs, params_list in group_writes(batch):
+                if params_list and len(params_list) > 1:
+                    # Async connections can't use execute_batch, so send
+                    # pages of mogrified statements in one round trip
+                    for page in range(0, len(params_list), 100):
+                        await cur.execute(b";".join(
+                            cur.mogrify(args[0], params)
+                            for params in params_list[page:page + 100]
+                        ))
+                else:
+                    await cur.execute(*args, **kwargs)
+            await cur.execute("COMMIT")
+        except psycopg2.Error:
+            # Replay the batch one statement at a time to isolate the failure
+            await cur.execute("ROLLBACK")
+            failures = await async_write_isolated(psql, cur, batch)
+        else:
+            for args, kwargs, future in batch:
+                if not future.done():
+                    future.set_result(None)
+    except Exception as e:
+        # The connection itself failed, nothing in the batch was committed
+        for args, kwargs, future in batch:
+            if not future.done():
+                future.set_exception(e)
+                failures += 1
+    finally:
+        cur.close()
+    psql.write_stats.record(len(batch), failures, monotonic() - start)
+
+
+async def async_write_isolated(psql, cur, batch):
+    failures = 0
+    committed = []
+    await cur.execute("BEGIN")
+    for args, kwargs, future in batch:
+        await cur.execute("SAVEPOINT sql_write")
+        try:
+            await cur.execute(*args, **kwargs)
+        except psycopg2.Error as e:
+            await cur.execute("ROLLBACK TO SAVEPOINT sql_write")
+            failures += 1
+            if not future.done():
+                future.set_exception(e)
+            psql.write_failed(args, kwargs, e)
+        else:
+            await cur.execute("RELEASE SAVEPOINT sql_write")
+            committed.append(future)
+    await cur.execute("COMMIT")
+    for future in committed:
+        if not future.done():
+            future.set_result(None)
+    return failures
+
+
+def benchmark(connection_string, threads, queries, sql):
+    """
+    Run queries read queries spread across threads and return the
+    queries per second of each way of reading: single, one connection
+    shared by every thread as before the pool, shared, PSQL.query on a
+    pool of one connection, and pool, PSQL.query on a pool sized to the
+    thread count.
+    """
+    results = {}
+    for name, max_size in (("single", None), ("shared", 1), ("pool", threads)):
+        if max_size is None:
+            connection = psycopg2.connect(connection_string)
+
+            def reader(count):
+                for _ in range(count):
+                    cur = connection.cursor()
+                    cur.execute(sql)
+                    cur.fetchall()
+                    cur.close()
+        else:
+            db = PSQL(
+                connection_string,
+                pool_min_size=max_size,
+                pool_max_size=max_size,
+                pool_timeout=None
+            )
+
+            def reader(count):
+                for _ in range(count):
+                    db.query(sql)
+
+        workers = [
+            threading.Thread(target=reader, args=(queries // threads,))
+            for _ in range(threads)
+        ]
+        start = monotonic()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        results[name] = (queries // threads) * threads / (monotonic() - start)
+        if max_size is None:
+            connection.close()
+        else:
+            db.close()
+    return results
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser()
+    parser.add_argument("connection_string")
+    parser.add_argument("--threads", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--sql", default="SELECT pg_sleep(0.001)")
+    args = parser.parse_args()
+
+    for threads in args.threads:
+        results = benchmark(args.connection_string, threads, args.queries, args.sql)
+        print("{:>3} threads: single {:>9.1f} q/s, shared {:>9.1f} q/s, pool {:>9.1f} q/s".format(
+            threads, results["single"], results["shared"], results["pool"]
+        ))
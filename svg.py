@@ -1,9 +1,9 @@
 #!/usr/bin/env python3.7
 import os
 import re
-import subprocess
 from textwrap import dedent
 from collections import namedtuple
+from copy import copy
 from pathlib import Path
 
 
@@ -40,6 +40,13 @@ PATH_PATTERN = re.compile(
     r'<\s*path[^>]*\sd="([^"]*)"[^>]*/?>',
     re.DOTALL | re.I
 )
+PATH_TOKEN_PATTERN = re.compile(
+    r'([MmZzLlHhVvCcSsQqTtAa])|([-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?)'
+)
+PATH_ARITY = {
+    'M': 2, 'L': 2, 'T': 2, 'H': 1, 'V': 1,
+    'C': 6, 'S': 4, 'Q': 4, 'A': 7, 'Z': 0
+}
 
 
 def clipPath(obj):
@@ -71,6 +78,178 @@ def parse_paths(src):
     return int(float(width)), int(float(height)), paths
 
 
+MinifyResultFields = ('paths', 'original_size', 'minified_size')
+class MinifyResult(namedtuple("MinifyResult", MinifyResultFields)):
+    @property
+    def saved(self):
+        return self.original_size - self.minified_size
+
+
+def tokenize_path(d):
+    """
+    Parse path data into a list of (command, args) segments where every
+    command is an uppercase M, L, C, S, Q, T, A or Z with absolute args.
+    H and V are expanded to L.
+    """
+    tokens = PATH_TOKEN_PATTERN.findall(d)
+    segments = []
+    cx = cy = sx = sy = 0.0
+    command = None
+    i = 0
+    while i < len(tokens):
+        letter, number = tokens[i]
+        if letter:
+            command = letter
+            i += 1
+            if letter in 'Zz':
+                segments.append(('Z', ()))
+                cx, cy = sx, sy
+            continue
+        elif command is None or command in 'Zz':
+            raise ValueError("Path data number outside of a command")
+
+        upper = command.upper()
+        relative = command.islower()
+        args = []
+        while len(args) < PATH_ARITY[upper]:
+            if i >= len(tokens) or tokens[i][0]:
+                raise ValueError("Truncated path data")
+            text = tokens[i][1]
+            # Arc flags may be written without separators, e.g. "a5 5 0 0150 50"
+            if upper == 'A' and len(args) in (3, 4) and len(text) > 1:
+                args.append(float(text[0]))
+                tokens[i] = ('', text[1:])
+            else:
+                args.append(float(text))
+                i += 1
+
+        if upper == 'H':
+            upper = 'L'
+            args = [args[0] + cx if relative else args[0], cy]
+        elif upper == 'V':
+            upper = 'L'
+            args = [cx, args[0] + cy if relative else args[0]]
+        elif relative and upper == 'A':
+            args[5] += cx
+            args[6] += cy
+        elif relative:
+            for k in range(0, len(args), 2):
+                args[k] += cx
+                args[k + 1] += cy
+
+        cx, cy = args[-2], args[-1]
+        if upper == 'M':
+            sx, sy = cx, cy
+            # Extra coordinate pairs after a moveto are implicit linetos
+            command = 'l' if relative else 'L'
+        segments.append((upper, args))
+
+    return segments
+
+
+def _format_number(value, precision):
+    text = repr(round(value, precision) + 0.0)
+    if text.endswith('.0'):
+        text = text[:-2]
+    if text.startswith('0.'):
+        text = text[1:]
+    elif text.startswith('-0.'):
+        text = '-' + text[2:]
+    return text
+
+
+def _join_numbers(numbers, last):
+    parts = []
+    for text in numbers:
+        if last is not None and not (
+                    text[0] == '-' or
+                    (text[0] == '.' and '.' in last and 'e' not in last)
+                ):
+            parts.append(' ')
+        parts.append(text)
+        last = text
+    return ''.join(parts)
+
+
+def minify_path(d, precision=3):
+    """
+    Rewrite path data with coordinates rounded to the given number of
+    decimal places, using whichever of the absolute or relative form of
+    each command is shorter and dropping redundant commands and whitespace.
+    """
+    segments = tokenize_path(d)
+    output = []
+    implied = None
+    last = None
+    cx = cy = sx = sy = 0.0
+    for index, (command, args) in enumerate(segments):
+        following = segments[index + 1][0] if index + 1 < len(segments) else None
+        if command == 'Z':
+            output.append('z')
+            implied = None
+            last = None
+            cx, cy = sx, sy
+            continue
+
+        # A moveto followed by another moveto (or nothing) draws nothing
+        if command == 'M' and following in (None, 'M'):
+            continue
+
+        args = [round(arg, precision) for arg in args]
+        if command == 'L':
+            x, y = args
+            # Zero length lines are dropped unless a smooth curve reflects off them
+            if x == cx and y == cy and following not in ('S', 'T'):
+                continue
+            elif y == cy:
+                command = 'H'
+                absolute = [x]
+                relative = [x - cx]
+            elif x == cx:
+                command = 'V'
+                absolute = [y]
+                relative = [y - cy]
+        if command == 'A':
+            absolute = args
+            relative = args[:5] + [args[5] - cx, args[6] - cy]
+        elif command not in ('H', 'V'):
+            absolute = args
+            relative = [
+                arg - (cy if k % 2 else cx) for k, arg in enumerate(args)
+            ]
+
+        best = None
+        for letter, values in ((command, absolute), (command.lower(), relative)):
+            numbers = [_format_number(value, precision) for value in values]
+            if letter == implied:
+                text = _join_numbers(numbers, last)
+            else:
+                text = letter + _join_numbers(numbers, None)
+            if best is None or len(text) < len(best[0]):
+                best = (text, letter, numbers[-1])
+        text, letter, last = best
+        output.append(text)
+
+        if letter in 'Mm':
+            implied = 'l' if letter == 'm' else 'L'
+        else:
+            implied = letter
+        cx, cy = args[-2], args[-1]
+        if command == 'M':
+            sx, sy = cx, cy
+
+    return ''.join(output)
+
+
+def minify_paths(paths, precision=3):
+    minified = [minify_path(d, precision) for d in paths]
+    return MinifyResult(
+        minified,
+        sum(len(d) for d in paths),
+        sum(len(d) for d in minified)
+    )
+
+
 def indent(text, indent=1, token='    '):
     token *= indent
     return text.replace("\n", "\n" + token)
@@ -153,6 +332,76 @@ class Gradient(namedtuple("Gradient", GradientFields)):
             raise ValueError("Invalid gradient shape")
 
 
+class Icon:
+    """
+    Parsed path data for a single input SVG, shared between every
+    variant rendered from it along with the style-independent fragments
+    of the output.
+    """
+    def __init__(self, src, *, precision=None):
+        self.width, self.height, self.paths = parse_paths(src)
+        self.bytes_saved = 0
+        if precision is not None:
+            result = minify_paths(self.paths, precision)
+            self.paths = result.paths
+            self.bytes_saved = result.saved
+        self.reset()
+
+    def __repr__(self):
+        return "{}(width={}, height={}, paths={})".format(
+            type(self).__name__,
+            self.width,
+            self.height,
+            len(self.paths)
+        )
+
+    def reset(self):
+        """
+        Rebuild the opening tag and drop the cached fragments.
+        """
+        self.xml_open = '<svg xmlns="{}" viewBox="0 0 {} {}">'.format(
+            XMLNS,
+            self.width,
+            self.height
+        )
+        self.fragments = {}
+
+    def replace(self, **fields):
+        """
+        Return a copy with some of width, height and paths replaced,
+        leaving this Icon and the variants sharing it untouched.
+        """
+        icon = copy(self)
+        for name, value in fields.items():
+            setattr(icon, name, value)
+        icon.reset()
+        return icon
+
+    def fragment(self, key, build):
+        try:
+            return self.fragments[key]
+        except KeyError:
+            value = self.fragments[key] = build()
+            return value
+
+    def variant(self, **style):
+        return SVG(self, **style)
+
+    def render(self, styles):
+        """
+        Render one SVG string per style, where each style is a dict of
+        SVG keyword arguments.
+        """
+        return [str(self.variant(**style)) for style in styles]
+
+    def output(self, targets, filetype=None):
+        """
+        Write every (path, style) pair in targets.
+        """
+        for path, style in targets:
+            self.variant(**style).output(path, filetype)
+
+
 class SVG:
     def __init__(self, src, *,
                 bg_shape=None,
@@ -160,9 +409,15 @@ class SVG:
                 fg_fill="#FFFFFF",
                 fg_stroke=3,
                 shadow=False,
-                clip=True
+                clip=True,
+                precision=None
             ):
-        self.width, self.height, self.paths = parse_paths(src)
+        if isinstance(src, Icon):
+            if precision is not None:
+                raise ValueError("precision only applies when parsing src, not to an Icon")
+            self.icon = src
+        else:
+            self.icon = Icon(src, precision=precision)
         self.bg_shape = bg_shape
         self.bg_fill = bg_fill
         self.fg_fill = fg_fill
@@ -193,30 +448,43 @@ class SVG:
             self.xml_close
         )
 
+    @property
+    def width(self):
+        return self.icon.width
+
+    @width.setter
+    def width(self, width):
+        self.icon = self.icon.replace(width=width)
+
+    @property
+    def height(self):
+        return self.icon.height
+
+    @height.setter
+    def height(self, height):
+        self.icon = self.icon.replace(height=height)
+
+    @property
+    def paths(self):
+        return self.icon.paths
+
+    @paths.setter
+    def paths(self, paths):
+        self.icon = self.icon.replace(paths=paths)
+
+    @property
+    def bytes_saved(self):
+        return self.icon.bytes_saved
+
     @property
     def xml_open(self):
-        return '<svg xmlns="{}" viewBox="0 0 {} {}">'.format(
-            XMLNS,
-            self.width,
-            self.height
-        )
+        return self.icon.xml_open
 
     @property
     def xml_header(self):
         defs = set()
-        if self.clip:
-            if self.bg_shape == SQUARE:
-                defs.add(
-                    clipPath(
-                        Rectangle(4, 4, self.width - 8, self.height - 8, 0, "#FFFFFF")
-                    )
-                )
-            elif self.bg_shape == CIRCLE:
-                defs.add(
-                    clipPath(
-                        Circle(self.width // 2, self.height // 2, self.width // 2 - 8, "#FFFFFF")
-                    )
-                )
+        if self.clip and self.bg_shape in (SQUARE, CIRCLE):
+            defs.add(self.icon.fragment(('clip', self.bg_shape), self.xml_clip))
         if self.shadow:
             defs.add(SHADOW_FILTER)
         if isinstance(self.fg_fill, Gradient):
@@ -232,37 +500,73 @@ class SVG:
         else:
             return "<defs></defs>"
 
+    def xml_clip(self):
+        if self.bg_shape == SQUARE:
+            return clipPath(
+                Rectangle(4, 4, self.width - 8, self.height - 8, 0, "#FFFFFF")
+            )
+        elif self.bg_shape == CIRCLE:
+            return clipPath(
+                Circle(self.width // 2, self.height // 2, self.width // 2 - 8, "#FFFFFF")
+            )
+
     @property
     def xml_body(self):
         body = []
 
         # Add background
-        if self.bg_shape == SQUARE:
-            body.append(str(
-                Rectangle(0, 0, self.width, self.height, 0, "#000000")
+        if self.bg_shape in (SQUARE, CIRCLE):
+            body.append(self.icon.fragment(
+                ('background', self.bg_shape, reference_of(self.bg_fill)),
+                self.xml_background
+            ))
+
+        # Add paths
+        if self.paths:
+            body.append(self.icon.fragment(
+                (
+                    'paths',
+                    reference_of(self.fg_fill),
+                    self.fg_stroke,
+                    self.clip,
+                    self.shadow
+                ),
+                self.xml_paths
             ))
-            body.append(str(
-                Rectangle(4, 4, self.width - 8, self.height - 8, 0, reference_of(self.bg_fill))
+
+        # Return body
+        if body:
+            return dedent("""\
+                <g class="fg">
+                    {}
+                </g>
+            """).format(indent("\n".join(body)))
+        else:
+            return '<g class="fg"></g>'
+
+    def xml_background(self):
+        if self.bg_shape == SQUARE:
+            return "\n".join((
+                str(Rectangle(0, 0, self.width, self.height, 0, "#000000")),
+                str(Rectangle(4, 4, self.width - 8, self.height - 8, 0, reference_of(self.bg_fill)))
             ))
         elif self.bg_shape == CIRCLE:
-            body.append(str(
-                Circle(
+            return "\n".join((
+                str(Circle(
                     self.width // 2,
                     self.height // 2,
                     self.width // 2,
                     "#000000"
-                )
-            ))
-            body.append(str(
-                Circle(
+                )),
+                str(Circle(
                     self.width // 2,
                     self.height // 2,
                     self.width // 2 - 8,
                     reference_of(self.bg_fill)
-                )
+                ))
             ))
 
-        # Add paths
+    def xml_paths(self):
         fg_attributes = []
         if self.fg_stroke:
             fg_attributes.append('stroke="black"')
@@ -272,20 +576,12 @@ class SVG:
         if self.shadow:
             fg_attributes.append('filter="url(#shadow)"')
 
-        for path in self.paths:
-            body.append('<path d="{}" fill="{}" fill-opacity="1" {}></path>'.format(
+        return "\n".join(
+            '<path d="{}" fill="{}" fill-opacity="1" {}></path>'.format(
                 path, reference_of(self.fg_fill), " ".join(fg_attributes)
-            ))
-
-        # Return body
-        if body:
-            return dedent("""\
-                <g class="fg">
-                    {}
-                </g>
-            """).format(indent("\n".join(body)))
-        else:
-            return '<g class="fg"></g>'
+            )
+            for path in self.paths
+        )
 
     @property
     def xml_close(self):
@@ -303,6 +599,8 @@ class SVG:
             with open(path.with_suffix('.svg'), "w") as img:
                 img.write(str(self))
         elif filetype == FILE_PNG:
+            import subprocess
+
             with open(path.with_suffix('.tmp'), "w") as svg:
                 svg.write(str(self))
             subprocess.run([
@@ -362,12 +660,14 @@ if __name__ == '__main__':
     parser.add_argument('--fg', type=ArgumentColor, default='#FFFFFF')
     parser.add_argument('--bg', type=ArgumentColor, default='#969696:#646464')
     parser.add_argument('--shape', type=ArgumentShape, default=None)
+    parser.add_argument('--precision', type=int, default=None)
     args = parser.parse_args()
 
     svg = SVG(
         args.input,
         fg_fill=args.fg,
         bg_fill=args.bg,
-        bg_shape=args.shape
+        bg_shape=args.shape,
+        precision=args.precision
     )
     svg.output(args.output)